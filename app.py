@@ -4,14 +4,17 @@ from flask_cors import CORS
 from datetime import datetime, date, timedelta, timezone
 import os
 
+from storage import configure_storage, apply_pragmas
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///habits.db'
+# Database configuration (DATABASE_URL / STORAGE_PROFILE, see storage.py)
+configure_storage(app, 'sqlite:///habits.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
+apply_pragmas(app, db)
 
 # Models
 class Habit(db.Model):
@@ -26,14 +29,32 @@ class Habit(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     
     habit_logs = db.relationship('HabitLog', backref='habit', lazy=True, cascade='all, delete-orphan')
+    streak = db.relationship('HabitStreak', backref='habit', uselist=False, cascade='all, delete-orphan')
+
+def default_log_day(context):
+    completed_at = context.get_current_parameters().get('completed_at')
+    return (completed_at or datetime.now(timezone.utc)).date()
 
 class HabitLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_habit_log_habit_day', 'habit_id', 'day'),
+        db.Index('ix_habit_log_habit_completed', 'habit_id', 'completed_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False)
     completed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    day = db.Column(db.Date, default=default_log_day, index=True)  # Calendar day the log counts for
     notes = db.Column(db.Text)
     count = db.Column(db.Integer, default=1)
 
+class HabitStreak(db.Model):
+    # Materialized streak state, advanced on every completion
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    current_streak = db.Column(db.Integer, default=0)
+    longest_streak = db.Column(db.Integer, default=0)
+    last_completed_day = db.Column(db.Date)
+
 # API Routes
 @app.route('/api/habits', methods=['GET'])
 def get_habits():
@@ -123,7 +144,7 @@ def complete_habit(habit_id):
     today = date.today()
     existing_log = HabitLog.query.filter(
         HabitLog.habit_id == habit_id,
-        db.func.date(HabitLog.completed_at) == today
+        HabitLog.day == today
     ).first()
     
     if existing_log:
@@ -133,11 +154,13 @@ def complete_habit(habit_id):
     else:
         log = HabitLog(
             habit_id=habit_id,
+            day=today,
             count=data.get('count', 1),
             notes=data.get('notes', '')
         )
         db.session.add(log)
     
+    record_streak_completion(habit_id, today)
     db.session.commit()
     
     return jsonify({
@@ -160,55 +183,131 @@ def get_habit_logs(habit_id):
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    active_habits = Habit.query.filter_by(is_active=True).all()
-    total_habits = len(active_habits)
+    today = date.today()
+    week_ago = today - timedelta(days=7)
     
-    today_completed = 0
-    for habit in active_habits:
-        if get_today_completion(habit.id):
-            today_completed += 1
+    # Active habits and how many have a log today, via the (habit_id, day) index
+    done_today = db.exists().where(HabitLog.habit_id == Habit.id, HabitLog.day == today)
+    total_habits, today_completed = db.session.query(
+        db.func.count(Habit.id),
+        db.func.count(db.case((done_today, 1)))
+    ).filter(Habit.is_active == True).one()
     
-    # Get completion rate for last 7 days
-    week_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    week_logs = HabitLog.query.filter(HabitLog.completed_at >= week_ago).all()
+    # Activity count for the last 7 days, answered from the day index
+    week_activities = db.session.query(db.func.count(HabitLog.id)).filter(HabitLog.day >= week_ago).scalar()
     
     return jsonify({
         'total_habits': total_habits,
         'today_completed': today_completed,
         'completion_rate': (today_completed / total_habits * 100) if total_habits > 0 else 0,
-        'week_activities': len(week_logs)
+        'week_activities': week_activities
     })
 
 def get_today_completion(habit_id):
     today = date.today()
     log = HabitLog.query.filter(
         HabitLog.habit_id == habit_id,
-        db.func.date(HabitLog.completed_at) == today
+        HabitLog.day == today
     ).first()
     return log is not None
 
+def advance_streak(current, longest, last_day, day):
+    """Fold one completion day (in ascending order) into streak state."""
+    if last_day == day:
+        return current, longest, last_day
+    
+    if last_day == day - timedelta(days=1):
+        current += 1
+    else:
+        current = 1
+    
+    return current, max(longest, current), day
+
+def record_streak_completion(habit_id, day):
+    streak = HabitStreak.query.get(habit_id)
+    if streak is None:
+        streak = HabitStreak(habit_id=habit_id, current_streak=0, longest_streak=0)
+        db.session.add(streak)
+    
+    # Backdated completions can split or join runs, so recompute those
+    if streak.last_completed_day and day < streak.last_completed_day:
+        rebuild_streaks([habit_id])
+        return
+    
+    streak.current_streak, streak.longest_streak, streak.last_completed_day = advance_streak(
+        streak.current_streak, streak.longest_streak, streak.last_completed_day, day
+    )
+
+def rebuild_streaks(habit_ids=None):
+    """Recompute streak records from the logs. Returns the number of habits."""
+    query = db.session.query(HabitLog.habit_id, HabitLog.day)
+    if habit_ids is not None:
+        query = query.filter(HabitLog.habit_id.in_(habit_ids))
+    
+    state = {}
+    for habit_id, day in query.order_by(HabitLog.habit_id, HabitLog.day).yield_per(1000):
+        current, longest, last_day = state.get(habit_id, (0, 0, None))
+        state[habit_id] = advance_streak(current, longest, last_day, day)
+    
+    if habit_ids is None:
+        habit_ids = [habit_id for (habit_id,) in db.session.query(Habit.id)]
+    
+    existing = {
+        streak.habit_id: streak
+        for streak in HabitStreak.query.filter(HabitStreak.habit_id.in_(habit_ids))
+    }
+    for habit_id in habit_ids:
+        streak = existing.get(habit_id)
+        if streak is None:
+            streak = HabitStreak(habit_id=habit_id)
+            db.session.add(streak)
+        streak.current_streak, streak.longest_streak, streak.last_completed_day = state.get(habit_id, (0, 0, None))
+    
+    return len(habit_ids)
+
 def get_streak(habit_id):
-    logs = HabitLog.query.filter_by(habit_id=habit_id).order_by(HabitLog.completed_at.desc()).all()
+    streak = HabitStreak.query.get(habit_id)
+    if streak is None or streak.last_completed_day is None:
+        return 0
     
-    if not logs:
+    # A run stays alive until a full day passes without a completion
+    if streak.last_completed_day < date.today() - timedelta(days=1):
         return 0
+    return streak.current_streak
+
+def upgrade_database():
+    """Bring databases created by older versions up to the current schema."""
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('habit_log')}
     
-    streak = 0
-    current_date = date.today()
+    with db.engine.begin() as conn:
+        if 'day' not in columns:
+            conn.execute(db.text('ALTER TABLE habit_log ADD COLUMN day DATE'))
+            conn.execute(db.text('UPDATE habit_log SET day = date(completed_at)'))
     
-    for log in logs:
-        log_date = log.completed_at.date()
-        
-        if log_date == current_date:
-            streak += 1
-            current_date -= timedelta(days=1)
-        elif log_date == current_date - timedelta(days=1):
-            streak += 1
-            current_date = log_date
-        else:
-            break
+    for index in HabitLog.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+def init_db():
+    db.create_all()
+    upgrade_database()
     
-    return streak
+    # Backfill streak records for databases created before they existed
+    if HabitStreak.query.count() == 0 and HabitLog.query.count() > 0:
+        rebuild_streaks()
+        db.session.commit()
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and migrate existing ones in place."""
+    init_db()
+    print('Database is up to date')
+
+@app.cli.command('rebuild-streaks')
+def rebuild_streaks_command():
+    """Recompute every habit's streak record from its logs."""
+    count = rebuild_streaks()
+    db.session.commit()
+    print(f'Rebuilt streaks for {count} habits')
 
 @app.route('/')
 def index():
@@ -216,5 +315,5 @@ def index():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(debug=True, port=5000)
\ No newline at end of file
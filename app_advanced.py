@@ -1,22 +1,55 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime, date, timedelta, time
+from collections import namedtuple
+from datetime import datetime, date, timedelta, time, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import base64
+import csv
+import io
 import json
+import math
 import os
+import queue
+import time as clock
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import uuid
+import click
+
+import bitset
+from cache import LRUCache, SQLiteCache
+from completion_matrix import HAVE_NUMPY, CompletionMatrix
+from events import EventBroker
+from insights import build_insights
+from scheduler import FileSink, ReminderScheduler, ScheduledReminder, parse_weekdays
+from storage import RoutingSession, configure_storage, apply_pragmas, create_read_replica
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
-# Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///habits_advanced.db'
+# Configuration (DATABASE_URL / STORAGE_PROFILE, see storage.py)
+configure_storage(app, 'sqlite:///habits_advanced.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
+app.config['USER_CACHE_SIZE'] = 4096
+app.config['USER_CACHE_TTL'] = 300  # seconds
+app.config['MAX_BATCH_ENTRIES'] = 500
+app.config['IMPORT_CHUNK_ROWS'] = 5000
+app.config['RESPONSE_CACHE'] = os.environ.get('RESPONSE_CACHE', 'memory')  # memory, sqlite (shared between processes) or off
+app.config['RESPONSE_CACHE_SIZE'] = 2048
+app.config['RESPONSE_CACHE_TTL'] = 600  # seconds
+app.config['EVENT_QUEUE_SIZE'] = 100  # events buffered per open stream
+app.config['EVENT_KEEPALIVE'] = 15  # seconds between keepalive comments
+app.config['ANALYTICS_BACKEND'] = os.environ.get('ANALYTICS_BACKEND', 'sql')  # sql, or numpy (see completion_matrix.py)
+app.config['ANALYTICS_MATRIX_CACHE_SIZE'] = 64  # users whose history the numpy backend keeps loaded
+app.config['BITSET_HISTORY'] = os.environ.get('BITSET_HISTORY', 'off') == 'on'  # keep HabitYearBits in sync with the logs
+app.config['INSIGHT_CHUNK_USERS'] = 500  # users per generate-insights transaction
+app.config['INSIGHT_WINDOW_DAYS'] = 84  # history the weekday and mood patterns look at
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+apply_pragmas(app, db)
+app.extensions['read_replica'] = create_read_replica(app, db)
 
 # Database Models
 class User(db.Model):
@@ -36,6 +69,9 @@ class User(db.Model):
     xp = db.Column(db.Integer, default=0)
     total_coins = db.Column(db.Integer, default=0)
     
+    # Bumped by every change to the user's data; ETags are built from it
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     habits = db.relationship('Habit', backref='user', lazy=True, cascade='all, delete-orphan')
     user_badges = db.relationship('UserBadge', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -50,7 +86,7 @@ class Category(db.Model):
 
 class Habit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     
@@ -86,8 +122,19 @@ class Habit(db.Model):
     # Relationships
     habit_logs = db.relationship('HabitLog', backref='habit', lazy=True, cascade='all, delete-orphan')
     reminders = db.relationship('Reminder', backref='habit', lazy=True, cascade='all, delete-orphan')
+    streak = db.relationship('HabitStreak', backref='habit', uselist=False, cascade='all, delete-orphan')
+    year_bits = db.relationship('HabitYearBits', lazy=True, cascade='all, delete-orphan')
+
+def default_log_day(context):
+    completed_at = context.get_current_parameters().get('completed_at')
+    return (completed_at or datetime.utcnow()).date()
 
 class HabitLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_habit_log_habit_day', 'habit_id', 'day'),
+        db.Index('ix_habit_log_habit_status_completed', 'habit_id', 'status', 'completed_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False)
     
@@ -99,10 +146,40 @@ class HabitLog(db.Model):
     
     # Metadata
     completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    day = db.Column(db.Date, default=default_log_day)  # Calendar day the log counts for
     notes = db.Column(db.Text)
     mood = db.Column(db.Integer)  # 1-5 mood rating
     duration_minutes = db.Column(db.Integer)  # Time spent in minutes
 
+class HabitStreak(db.Model):
+    # Materialized streak state, advanced on every completion
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    current_streak = db.Column(db.Integer, default=0)
+    longest_streak = db.Column(db.Integer, default=0)
+    last_completed_day = db.Column(db.Date)
+    last_active_day = db.Column(db.Date)  # Last day completed, or skipped where skips keep the run
+
+class DailyRollup(db.Model):
+    # Per user/day/habit totals, maintained alongside HabitLog writes
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    
+    completed = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    missed = db.Column(db.Integer, default=0)
+    total_value = db.Column(db.Float, default=0)
+    total_duration = db.Column(db.Integer, default=0)
+    mood_total = db.Column(db.Integer, default=0)
+    mood_count = db.Column(db.Integer, default=0)
+
+class HabitYearBits(db.Model):
+    # Optional compact history (BITSET_HISTORY): one bit per day of the year, see bitset.py
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    completed = db.Column(db.LargeBinary(bitset.YEAR_BYTES), nullable=False)
+    skipped = db.Column(db.LargeBinary(bitset.YEAR_BYTES), nullable=False)
+
 class Reminder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False)
@@ -133,6 +210,14 @@ class UserBadge(db.Model):
     badge_id = db.Column(db.Integer, db.ForeignKey('badge.id'), nullable=False)
     earned_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class UserStats(db.Model):
+    # Running counters the badge rules are evaluated against
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_completions = db.Column(db.Integer, default=0)
+    best_streak = db.Column(db.Integer, default=0)
+    early_bird_days = db.Column(db.Integer, default=0)
+    last_early_bird_day = db.Column(db.Date)
+
 class UserGoal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -173,21 +258,35 @@ class Challenge(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     habit_template = db.Column(db.Text)  # JSON template for the challenge habit
+    participant_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     participants = db.relationship('ChallengeParticipant', backref='challenge', lazy=True, cascade='all, delete-orphan')
 
 class ChallengeParticipant(db.Model):
+    __table_args__ = (
+        # Leaderboard order; ranks are counted off the same index
+        db.Index('ix_challenge_participant_rank', 'challenge_id', 'days_completed', 'current_streak'),
+        db.Index('ix_challenge_participant_habit', 'habit_id'),
+        db.Index('ix_challenge_participant_user', 'user_id', 'challenge_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     challenge_id = db.Column(db.Integer, db.ForeignKey('challenge.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'))  # The participant's copy of the challenge habit
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Tracking
-    days_completed = db.Column(db.Integer, default=0)
-    current_streak = db.Column(db.Integer, default=0)
+    # Tracking, advanced as the challenge habit is completed between start_date and end_date
+    days_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    current_streak = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Run ending at last_completed_day
+    last_completed_day = db.Column(db.Date)
 
 class AIInsight(db.Model):
+    __table_args__ = (
+        db.Index('ix_ai_insight_user_unread', 'user_id', 'is_read', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     insight_type = db.Column(db.String(50))  # pattern, suggestion, motivation
@@ -198,98 +297,1202 @@ class AIInsight(db.Model):
     is_read = db.Column(db.Boolean, default=False)
 
 # Helper functions
+# Read-only view of a User, safe to share between requests
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'username', 'email', 'level', 'xp', 'total_coins', 'theme', 'timezone'])
+
+# verified token -> UserSnapshot, tagged with the user id for invalidation
+user_cache = LRUCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+def create_response_cache():
+    backend = app.config['RESPONSE_CACHE']
+    if backend == 'memory':
+        return LRUCache(maxsize=app.config['RESPONSE_CACHE_SIZE'], ttl=app.config['RESPONSE_CACHE_TTL'])
+    if backend == 'sqlite':
+        os.makedirs(app.instance_path, exist_ok=True)
+        return SQLiteCache(os.path.join(app.instance_path, 'response_cache.db'),
+                           maxsize=app.config['RESPONSE_CACHE_SIZE'], ttl=app.config['RESPONSE_CACHE_TTL'])
+    if backend == 'off':
+        return None
+    raise ValueError(f'Unknown RESPONSE_CACHE {backend!r}, expected memory, sqlite or off')
+
+# ETag + URL -> response body, tagged with the user id for invalidation
+response_cache = create_response_cache()
+
+def check_analytics_backend():
+    backend = app.config['ANALYTICS_BACKEND']
+    if backend not in ('sql', 'numpy'):
+        raise ValueError(f'Unknown ANALYTICS_BACKEND {backend!r}, expected sql or numpy')
+    if backend == 'numpy' and not HAVE_NUMPY:
+        raise RuntimeError('ANALYTICS_BACKEND=numpy needs numpy installed (pip install numpy)')
+
+check_analytics_backend()
+
+# data ETag -> the user's CompletionMatrix, tagged with the user id for invalidation
+matrix_cache = LRUCache(maxsize=app.config['ANALYTICS_MATRIX_CACHE_SIZE'], ttl=app.config['RESPONSE_CACHE_TTL'])
+
+# Per-user server-sent events for the streams open in this process
+event_broker = EventBroker(queue_size=app.config['EVENT_QUEUE_SIZE'])
+
 def get_user_from_token(token):
+    """Resolve a token to a UserSnapshot, or None. Load the User row to change it."""
+    snapshot = user_cache.get(token)
+    if snapshot is not None:
+        return snapshot
+    
     try:
         payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        return User.query.get(payload['user_id'])
+        user_id = payload['user_id']
     except:
         return None
+    
+    version = user_cache.tag_version(user_id)
+    user = User.query.get(user_id)
+    if not user:
+        return None
+    
+    snapshot = UserSnapshot(user.id, user.username, user.email, user.level, user.xp,
+                            user.total_coins, user.theme, user.timezone)
+    user_cache.set(token, snapshot, tag=user.id, version=version)
+    return snapshot
+
+@db.event.listens_for(User, 'after_update')
+def invalidate_cached_user(mapper, connection, user):
+    # Drop now, and again once committed so a concurrent reload can't keep old values
+    user_cache.invalidate_tag(user.id)
+    db.object_session(user).info.setdefault('changed_users', set()).add(user.id)
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        user_cache.invalidate_tag(user_id)
+        # Cached responses are keyed by data version, so these are unreachable already; free the space
+        if response_cache is not None:
+            response_cache.invalidate_tag(user_id)
+        matrix_cache.invalidate_tag(user_id)
+
+def bump_data_version(user):
+    """Mark the user's data as changed so cached copies stop validating; commits with the caller."""
+    user.data_version = User.data_version + 1  # In SQL, so concurrent bumps can't collapse into one
+
+def data_etag(user):
+    """(user, ETag) for a read of the user's data. Call it before read_from_replica.
+    
+    The ETag versions everything a user's reads return. The returned user is
+    the snapshot with level, XP and coins as of the same read, so a body never
+    pairs a fresh ETag with progress from an old snapshot.
+    """
+    # From the primary by key on every request: other workers and the CLI change these, and
+    # the snapshot in user_cache is only this process's copy
+    data_version, level, xp, total_coins = db.session.query(
+        User.data_version, User.level, User.xp, User.total_coins
+    ).filter(User.id == user.id).one()
+    user = user._replace(level=level, xp=xp, total_coins=total_coins)
+    # Responses also change at the user's midnight (today's status, streaks), without any write
+    return user, f'{user.id}-{data_version}-{user_today(user).isoformat()}'
+
+def not_modified(etag):
+    """A 304 for a request that already holds this version, else None. Costs no queries."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def with_etag(response, etag):
+    # Rows read from a lagging replica may predate this version, so those go out untagged
+    if db.session.info.get('replica') is None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def cached_response(etag):
+    """The cached body for this URL at the user's current data version, as a response, or None."""
+    if response_cache is None:
+        return None
+    body = response_cache.get(f'{etag}:{request.full_path}')
+    if body is None:
+        return None
+    return with_etag(Response(body, mimetype='application/json'), etag)
+
+def cache_response(user, etag, response):
+    if response_cache is not None and db.session.info.get('replica') is None:
+        response_cache.set(f'{etag}:{request.full_path}', response.get_data(), tag=user.id)
+    return with_etag(response, etag)
+
+def queue_event(user_id, event_type, data):
+    """Push an event to the user's open streams once the current transaction commits."""
+    db.session.info.setdefault('events', []).append((user_id, event_type, data))
+
+@db.event.listens_for(db.session, 'after_commit')
+def publish_committed_events(session):
+    for user_id, event_type, data in session.info.pop('events', ()):
+        event_broker.publish(user_id, event_type, data)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def drop_rolled_back_events(session):
+    session.info.pop('events', None)
+
+def read_from_replica():
+    """Send the rest of this request's queries to the read replica, if one is configured and fresh."""
+    replica = app.extensions.get('read_replica')
+    engine = replica.engine_for_read() if replica else None
+    if engine is not None:
+        db.session.info['replica'] = engine
+
+@app.teardown_request
+def stop_reading_from_replica(exc):
+    # Replica routes only read, so there is nothing to lose by giving the connection back now
+    if db.session.info.pop('replica', None) is not None:
+        db.session.close()
+
+def get_zone(tz_name):
+    try:
+        return ZoneInfo(tz_name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+# timezone name -> (local date, UTC instant when that date ends)
+today_cache = {}
+
+def user_today(user):
+    """The user's current local calendar day, cached until their next midnight."""
+    tz_name = user.timezone or 'UTC'
+    now = datetime.now(timezone.utc)
+    
+    cached = today_cache.get(tz_name)
+    if cached and now < cached[1]:
+        return cached[0]
+    
+    zone = get_zone(tz_name)
+    today = now.astimezone(zone).date()
+    next_midnight = datetime.combine(today + timedelta(days=1), time.min, tzinfo=zone)
+    today_cache[tz_name] = (today, next_midnight)
+    return today
+
+def level_start_xp(level):
+    # Total XP needed to reach a level: 100 + 200 + ... + (level - 1) * 100
+    return 50 * level * (level - 1)
 
 def calculate_level(xp):
     # Level calculation: 100 XP for level 1, 200 for level 2, 300 for level 3, etc.
-    level = 1
-    xp_needed = 100
-    while xp >= xp_needed:
-        xp -= xp_needed
-        level += 1
-        xp_needed = level * 100
-    return level
-
-def award_xp(user_id, xp_amount, reason="Habit completion"):
-    user = User.query.get(user_id)
-    if user:
-        user.xp += xp_amount
-        new_level = calculate_level(user.xp)
-        if new_level > user.level:
-            user.level = new_level
-            # Award coins for level up
-            user.total_coins += 50
-        db.session.commit()
+    # Closed form of level_start_xp(level) <= xp, solved for the highest level
+    return (1 + math.isqrt(1 + 4 * (max(xp, 0) // 50))) // 2
 
-def check_badges(user_id):
-    user = User.query.get(user_id)
-    badges = Badge.query.all()
+def level_progress(user):
+    current_level_xp = level_start_xp(user.level)
+    return {
+        'current_level_xp': current_level_xp,
+        'next_level_xp': current_level_xp + (user.level * 100),
+        'xp_progress': ((user.xp - current_level_xp) / (user.level * 100)) * 100 if user.level > 0 else 0
+    }
+
+def progress_event(user):
+    return dict(level_progress(user), level=user.level, xp=user.xp, total_coins=user.total_coins)
+
+def award_xp(user, xp_amount, reason="Habit completion"):
+    # Changes are committed by the caller along with the rest of its unit of work
+    user.xp += xp_amount
+    new_level = calculate_level(user.xp)
+    if new_level > user.level:
+        user.level = new_level
+        # Award coins for level up
+        user.total_coins += 50
+
+# Badge condition_type -> the UserStats counter it is measured against
+BADGE_COUNTERS = {
+    'completion': 'total_completions',
+    'streak': 'best_streak',
+    'special': 'early_bird_days'
+}
+EARLY_BIRD_BEFORE = time(7)
+
+def get_user_stats(user_id):
+    stats = UserStats.query.get(user_id)
+    if stats is None:
+        stats = UserStats(user_id=user_id, total_completions=0, best_streak=0, early_bird_days=0)
+        db.session.add(stats)
+    return stats
+
+def record_completion_stats(stats, previous_status, status, day, streak, local_time=None):
+    """Advance a user's badge counters for one log write.
+    
+    local_time is the user's wall-clock time of the completion, when known.
+    """
+    if status == 'completed' and previous_status != 'completed':
+        stats.total_completions += 1
+    elif previous_status == 'completed' and status != 'completed':
+        stats.total_completions -= 1
+    
+    if status != 'completed':
+        return
+    
+    stats.best_streak = max(stats.best_streak, streak.longest_streak)
+    
+    # Days only ever move forward here; rebuild_user_stats recounts backfills
+    is_new_day = stats.last_early_bird_day is None or day > stats.last_early_bird_day
+    if local_time is not None and local_time < EARLY_BIRD_BEFORE and is_new_day:
+        stats.early_bird_days += 1
+        stats.last_early_bird_day = day
+
+def evaluate_badges(user, stats):
+    """Award every unearned badge whose threshold the user's counters meet. Returns the new badges."""
+    # All badges with the user's earned marker, in one query
+    rows = db.session.query(Badge, UserBadge.id).outerjoin(
+        UserBadge, db.and_(UserBadge.badge_id == Badge.id, UserBadge.user_id == user.id)
+    ).all()
     
-    for badge in badges:
-        # Check if user already has this badge
-        if UserBadge.query.filter_by(user_id=user_id, badge_id=badge.id).first():
-            continue
-            
-        earned = False
-        
-        if badge.condition_type == 'streak':
-            # Check for streak badges
-            max_streak = db.session.query(db.func.max(HabitLog.id)).filter(
-                HabitLog.habit_id.in_([h.id for h in user.habits])
-            ).scalar()
-            
-            if max_streak and max_streak >= badge.condition_value:
-                earned = True
-                
-        elif badge.condition_type == 'completion':
-            # Check for completion badges
-            total_completions = HabitLog.query.filter(
-                HabitLog.habit_id.in_([h.id for h in user.habits]),
-                HabitLog.status == 'completed'
-            ).count()
-            
-            if total_completions >= badge.condition_value:
-                earned = True
-        
-        if earned:
-            user_badge = UserBadge(user_id=user_id, badge_id=badge.id)
-            db.session.add(user_badge)
-            user.total_coins += badge.coin_reward
-            award_xp(user_id, badge.xp_reward, f"Badge earned: {badge.name}")
+    rules = {}
+    for badge, earned_id in rows:
+        if earned_id is None and badge.condition_type in BADGE_COUNTERS:
+            rules.setdefault(badge.condition_type, []).append(badge)
+    
+    earned = []
+    for condition_type, badges in rules.items():
+        value = getattr(stats, BADGE_COUNTERS[condition_type])
+        for badge in sorted(badges, key=lambda b: b.condition_value or 0):
+            if value < (badge.condition_value or 0):
+                break
+            earned.append(badge)
+    
+    for badge in earned:
+        user_badge = UserBadge(user_id=user.id, badge_id=badge.id)
+        db.session.add(user_badge)
+        user.total_coins += badge.coin_reward
+        award_xp(user, badge.xp_reward, f"Badge earned: {badge.name}")
+    
+    return earned
 
-def get_habit_streak(habit_id):
-    logs = HabitLog.query.filter_by(habit_id=habit_id, status='completed').order_by(HabitLog.completed_at.desc()).all()
+def rebuild_user_stats(user_ids=None):
+    """Recompute badge counters from the logs and streak records. Returns the number of users."""
+    users = User.query
+    if user_ids is not None:
+        users = users.filter(User.id.in_(user_ids))
+    users = {user.id: user for user in users}
+    
+    def scoped(query):
+        return query if user_ids is None else query.filter(Habit.user_id.in_(user_ids))
+    
+    completions = dict(scoped(db.session.query(Habit.user_id, db.func.count(HabitLog.id)).join(
+        HabitLog, HabitLog.habit_id == Habit.id
+    ).filter(HabitLog.status == 'completed')).group_by(Habit.user_id).all())
+    
+    best_streaks = dict(scoped(db.session.query(Habit.user_id, db.func.max(HabitStreak.longest_streak)).join(
+        HabitStreak, HabitStreak.habit_id == Habit.id
+    )).group_by(Habit.user_id).all())
+    
+    # Offline only: the one place completion times are converted per row
+    early_bird_days = {}
+    early_logs = scoped(db.session.query(Habit.user_id, HabitLog.completed_at, HabitLog.day).join(
+        HabitLog, HabitLog.habit_id == Habit.id
+    ).filter(HabitLog.status == 'completed'))
+    for user_id, completed_at, day in early_logs.yield_per(1000):
+        zone = get_zone(users[user_id].timezone)
+        if completed_at.replace(tzinfo=timezone.utc).astimezone(zone).time() < EARLY_BIRD_BEFORE:
+            early_bird_days.setdefault(user_id, set()).add(day)
+    
+    for user_id in users:
+        stats = get_user_stats(user_id)
+        stats.total_completions = completions.get(user_id, 0)
+        stats.best_streak = best_streaks.get(user_id) or 0
+        days = early_bird_days.get(user_id, set())
+        stats.early_bird_days = len(days)
+        stats.last_early_bird_day = max(days) if days else None
+    
+    return len(users)
+
+def advance_streak(current, longest, last_day, day):
+    """Fold one completion day (in ascending order) into streak state."""
+    if last_day == day:
+        return current, longest, last_day
     
-    if not logs:
-        return 0, 0  # current, longest
+    if last_day == day - timedelta(days=1):
+        current += 1
+    else:
+        current = 1
     
-    current_streak = 0
-    longest_streak = 0
-    temp_streak = 0
+    return current, max(longest, current), day
+
+def has_streak_rules(habit):
+    return bool(habit.allow_skips or habit.max_misses_per_week)
+
+def record_streak_completion(habit_id, day):
+    # Plain consecutive-day runs only; habits with streak rules go through record_streak_log
+    streak = HabitStreak.query.get(habit_id)
+    if streak is None:
+        streak = HabitStreak(habit_id=habit_id, current_streak=0, longest_streak=0)
+        db.session.add(streak)
+    
+    # Backdated completions can split or join runs, so recompute those
+    if streak.last_completed_day and day < streak.last_completed_day:
+        rebuild_habit_streaks([habit_id])
+        return streak
+    
+    streak.current_streak, streak.longest_streak, streak.last_completed_day = advance_streak(
+        streak.current_streak, streak.longest_streak, streak.last_completed_day, day
+    )
+    streak.last_active_day = streak.last_completed_day
+    return streak
+
+def record_streak_log(habit, day, previous_status, status):
+    """Bring a habit's streak record up to date after one log write. Returns it when status is completed."""
+    if not has_streak_rules(habit):
+        if status == 'completed':
+            return record_streak_completion(habit.id, day)
+        if previous_status == 'completed':
+            rebuild_habit_streaks([habit.id])
+    elif {previous_status, status} & {'completed', 'skipped'}:
+        # Skips and tolerated misses can bridge any two runs, so recompute the habit
+        rebuild_habit_streaks([habit.id])
+    return HabitStreak.query.get(habit.id) if status == 'completed' else None
+
+def day_number(column):
+    """A date column as a whole day count in SQL (the Julian day number, so day_number // 7 is a Monday-based week)."""
+    if db.engine.dialect.name == 'sqlite':
+        return db.cast(db.func.julianday(column) + 0.5, db.Integer)
+    return db.cast(db.extract('epoch', column) / 86400, db.Integer) + 2440588
+
+def query_habit_streaks(habit_ids=None):
+    """Streak state for many habits from their logs in one query, as gaps and islands.
+    
+    A run (island) is a stretch of active days: completed ones, plus skipped
+    ones for habits that allow skips. Skipped days keep a run going without
+    adding to it. Up to max_misses_per_week days without an active log can
+    fall between two active days, counted against the week of the day that
+    ends the gap. Several logs on one day count once.
+    
+    Returns habit_id -> (current run, longest run, last completed day, last active day),
+    for habits that have any active day; the current run is the one ending at the last active day.
+    """
+    done = db.case((HabitLog.status == 'completed', 1), else_=0)
+    days = db.session.query(
+        HabitLog.habit_id.label('habit_id'),
+        HabitLog.day.label('day'),
+        db.func.max(done).label('done'),
+        db.func.max(Habit.max_misses_per_week).label('max_misses')
+    ).join(Habit, Habit.id == HabitLog.habit_id).filter(
+        db.or_(HabitLog.status == 'completed', db.and_(HabitLog.status == 'skipped', Habit.allow_skips == True))
+    )
+    if habit_ids is not None:
+        days = days.filter(HabitLog.habit_id.in_(habit_ids))
+    days = days.group_by(HabitLog.habit_id, HabitLog.day).subquery()
+    
+    # Days without an active log since the previous active day
+    number = day_number(days.c.day)
+    gaps = db.session.query(
+        days.c.habit_id, days.c.day, days.c.done, days.c.max_misses,
+        (number // 7).label('week'),
+        (number - db.func.lag(number).over(partition_by=days.c.habit_id, order_by=days.c.day) - 1).label('gap')
+    ).subquery()
+    
+    week_misses = db.func.sum(db.func.coalesce(gaps.c.gap, 0)).over(
+        partition_by=(gaps.c.habit_id, gaps.c.week), order_by=gaps.c.day, rows=(None, 0)
+    )
+    starts_run = db.case(
+        (gaps.c.gap.is_(None), 1),
+        (gaps.c.gap == 0, 0),
+        (db.and_(gaps.c.gap <= db.func.coalesce(gaps.c.max_misses, 0), week_misses <= db.func.coalesce(gaps.c.max_misses, 0)), 0),
+        else_=1
+    )
+    flagged = db.session.query(gaps.c.habit_id, gaps.c.day, gaps.c.done, starts_run.label('starts_run')).subquery()
+    
+    numbered = db.session.query(
+        flagged.c.habit_id, flagged.c.day, flagged.c.done,
+        db.func.sum(flagged.c.starts_run).over(partition_by=flagged.c.habit_id, order_by=flagged.c.day, rows=(None, 0)).label('island')
+    ).subquery()
+    
+    # One row per run, each carrying the length of the habit's last run
+    length = db.func.sum(numbered.c.done)
+    last_active = db.func.max(numbered.c.day)
+    islands = db.session.query(
+        numbered.c.habit_id,
+        length.label('length'),
+        last_active.label('last_active'),
+        db.func.max(db.case((numbered.c.done == 1, numbered.c.day))).label('last_completed'),
+        db.func.first_value(length).over(partition_by=numbered.c.habit_id, order_by=last_active.desc()).label('current')
+    ).group_by(numbered.c.habit_id, numbered.c.island).subquery()
+    
+    rows = db.session.query(
+        islands.c.habit_id,
+        db.func.max(islands.c.current),
+        db.func.max(islands.c.length),
+        db.type_coerce(db.func.max(islands.c.last_completed), db.Date),
+        db.type_coerce(db.func.max(islands.c.last_active), db.Date)
+    ).group_by(islands.c.habit_id)
+    return {habit_id: (current, longest, last_completed, last_active) for habit_id, current, longest, last_completed, last_active in rows}
+
+def rebuild_habit_streaks(habit_ids=None):
+    """Recompute streak records from the logs. Returns the number of habits."""
+    state = query_habit_streaks(habit_ids)
+    
+    if habit_ids is None:
+        habit_ids = [habit_id for (habit_id,) in db.session.query(Habit.id)]
+    
+    existing = {
+        streak.habit_id: streak
+        for streak in HabitStreak.query.filter(HabitStreak.habit_id.in_(habit_ids))
+    }
+    for habit_id in habit_ids:
+        streak = existing.get(habit_id)
+        if streak is None:
+            streak = HabitStreak(habit_id=habit_id)
+            db.session.add(streak)
+        (streak.current_streak, streak.longest_streak,
+         streak.last_completed_day, streak.last_active_day) = state.get(habit_id, (0, 0, None, None))
+    
+    return len(habit_ids)
+
+def get_habit_streaks(habit_ids, today):
+    # Reads the materialized records; never touches the log history
+    if not habit_ids:
+        return {}
+    
+    streaks = {habit_id: (0, 0) for habit_id in habit_ids}
+    rows = db.session.query(HabitStreak, Habit.max_misses_per_week).join(
+        Habit, Habit.id == HabitStreak.habit_id
+    ).filter(HabitStreak.habit_id.in_(habit_ids))
+    for streak, max_misses in rows:
+        # A run stays alive until more days pass without an active log than the habit tolerates
+        alive = streak.last_active_day is not None and (today - streak.last_active_day).days - 1 <= (max_misses or 0)
+        streaks[streak.habit_id] = (streak.current_streak if alive else 0, streak.longest_streak)
+    return streaks
+
+def get_habit_streak(habit_id, today):
+    return get_habit_streaks([habit_id], today)[habit_id]  # current, longest
+
+def get_today_logs(habit_ids, today):
+    # Map habit_id -> first log recorded today, in a single query
+    if not habit_ids:
+        return {}
     
-    current_date = date.today()
+    logs = HabitLog.query.filter(
+        HabitLog.habit_id.in_(habit_ids),
+        HabitLog.day == today
+    ).order_by(HabitLog.id).all()
     
+    today_logs = {}
     for log in logs:
-        log_date = log.completed_at.date()
-        
-        if log_date == current_date:
-            current_streak += 1
-            temp_streak += 1
-            current_date -= timedelta(days=1)
-        elif log_date == current_date - timedelta(days=1):
-            temp_streak += 1
-            current_date = log_date
+        today_logs.setdefault(log.habit_id, log)
+    return today_logs
+
+# Year bitmaps
+def habit_year_bits(habit_ids, year=None):
+    """Year bitmaps built from the logs: habit_id -> {year: (completed bits, skipped bits)}, for one year or all."""
+    query = db.session.query(HabitLog.habit_id, HabitLog.day, HabitLog.status).filter(
+        HabitLog.habit_id.in_(habit_ids),
+        HabitLog.status.in_(('completed', 'skipped'))
+    )
+    if year is not None:
+        query = query.filter(HabitLog.day.between(date(year, 1, 1), date(year, 12, 31)))
+    
+    years = {}
+    for habit_id, day, status in query.yield_per(1000):
+        habit_years = years.setdefault(habit_id, {})
+        completed, skipped = habit_years.get(day.year, (0, 0))
+        if status == 'completed':
+            completed = bitset.with_day(completed, day, True)
         else:
+            skipped = bitset.with_day(skipped, day, True)
+        habit_years[day.year] = (completed, skipped)
+    return years
+
+def stored_year_bits(habit_id, year=None):
+    """{year: (completed bits, skipped bits)} for one habit, from HabitYearBits when it is kept, else from the logs."""
+    if not app.config['BITSET_HISTORY']:
+        return habit_year_bits([habit_id], year).get(habit_id, {})
+    rows = HabitYearBits.query.filter_by(habit_id=habit_id)
+    if year is not None:
+        rows = rows.filter_by(year=year)
+    return {row.year: (bitset.from_bytes(row.completed), bitset.from_bytes(row.skipped)) for row in rows}
+
+def record_year_bits(changes):
+    """Mirror log writes, {(habit_id, day): status}, into the year bitmaps."""
+    if not app.config['BITSET_HISTORY'] or not changes:
+        return
+    
+    habit_ids = {habit_id for habit_id, _ in changes}
+    years = {day.year for _, day in changes}
+    rows = {
+        (row.habit_id, row.year): row
+        for row in HabitYearBits.query.filter(HabitYearBits.habit_id.in_(habit_ids), HabitYearBits.year.in_(years))
+    }
+    for (habit_id, day), status in changes.items():
+        row = rows.get((habit_id, day.year))
+        if row is None:
+            row = rows[(habit_id, day.year)] = HabitYearBits(
+                habit_id=habit_id, year=day.year, completed=bitset.to_bytes(0), skipped=bitset.to_bytes(0)
+            )
+            db.session.add(row)
+        row.completed = bitset.to_bytes(bitset.with_day(bitset.from_bytes(row.completed), day, status == 'completed'))
+        row.skipped = bitset.to_bytes(bitset.with_day(bitset.from_bytes(row.skipped), day, status == 'skipped'))
+
+def rebuild_year_bits(habit_ids=None):
+    """Regenerate the year bitmaps from the logs. Returns the number of rows written."""
+    if habit_ids is None:
+        habit_ids = [habit_id for (habit_id,) in db.session.query(Habit.id)]
+    HabitYearBits.query.filter(HabitYearBits.habit_id.in_(habit_ids)).delete(synchronize_session=False)
+    rows = [
+        {'habit_id': habit_id, 'year': year, 'completed': bitset.to_bytes(completed), 'skipped': bitset.to_bytes(skipped)}
+        for habit_id, years in habit_year_bits(habit_ids).items()
+        for year, (completed, skipped) in years.items()
+    ]
+    if rows:
+        db.session.execute(db.insert(HabitYearBits), rows)
+    return len(rows)
+
+# Challenge leaderboards
+def record_challenge_logs(changes):
+    """Advance challenge counters for log writes, given {(habit_id, day): (previous_status, status)}."""
+    if not changes:
+        return
+    
+    habit_ids = {habit_id for habit_id, _ in changes}
+    days = {day for _, day in changes}
+    participants = {}
+    for participant in ChallengeParticipant.query.join(Challenge).options(
+        db.contains_eager(ChallengeParticipant.challenge)
+    ).filter(
+        ChallengeParticipant.habit_id.in_(habit_ids),
+        Challenge.start_date <= max(days),
+        Challenge.end_date >= min(days)
+    ):
+        participants.setdefault(participant.habit_id, []).append(participant)
+    
+    needs_rebuild = set()
+    for (habit_id, day), (previous_status, status) in sorted(changes.items(), key=lambda item: item[0][1]):
+        for participant in participants.get(habit_id, ()):
+            challenge = participant.challenge
+            if not challenge.start_date <= day <= challenge.end_date:
+                continue
+            if status == 'completed' and previous_status != 'completed':
+                # Backdated completions can join runs, so recompute those
+                if participant.last_completed_day and day < participant.last_completed_day:
+                    needs_rebuild.add(participant.id)
+                    continue
+                participant.days_completed += 1
+                participant.current_streak, _, participant.last_completed_day = advance_streak(
+                    participant.current_streak, 0, participant.last_completed_day, day
+                )
+            elif previous_status == 'completed' and status != 'completed':
+                needs_rebuild.add(participant.id)
+    
+    if needs_rebuild:
+        rebuild_challenge_counters(participant_ids=list(needs_rebuild))
+
+def rebuild_challenge_counters(participant_ids=None, habit_ids=None):
+    """Recount challenge participants' progress (and, for a full rebuild, challenge sizes). Returns the number of participants."""
+    participants = ChallengeParticipant.query
+    completions = db.session.query(ChallengeParticipant.id, HabitLog.day).join(
+        Challenge, Challenge.id == ChallengeParticipant.challenge_id
+    ).join(
+        HabitLog, HabitLog.habit_id == ChallengeParticipant.habit_id
+    ).filter(
+        HabitLog.status == 'completed',
+        HabitLog.day.between(Challenge.start_date, Challenge.end_date)
+    )
+    if participant_ids is not None:
+        participants = participants.filter(ChallengeParticipant.id.in_(participant_ids))
+        completions = completions.filter(ChallengeParticipant.id.in_(participant_ids))
+    if habit_ids is not None:
+        participants = participants.filter(ChallengeParticipant.habit_id.in_(habit_ids))
+        completions = completions.filter(ChallengeParticipant.habit_id.in_(habit_ids))
+    
+    state = {}
+    for participant_id, day in completions.distinct().order_by(ChallengeParticipant.id, HabitLog.day).yield_per(1000):
+        count, current, last_day = state.get(participant_id, (0, 0, None))
+        current, _, last_day = advance_streak(current, 0, last_day, day)
+        state[participant_id] = (count + 1, current, last_day)
+    
+    count = 0
+    for participant in participants:
+        participant.days_completed, participant.current_streak, participant.last_completed_day = state.get(participant.id, (0, 0, None))
+        count += 1
+    
+    if participant_ids is None and habit_ids is None:
+        sizes = dict(db.session.query(ChallengeParticipant.challenge_id, db.func.count()).group_by(ChallengeParticipant.challenge_id))
+        for challenge in Challenge.query:
+            challenge.participant_count = sizes.get(challenge.id, 0)
+    return count
+
+def challenge_rank(challenge_id, days_completed, current_streak):
+    """1 + the participants strictly ahead; two range counts on ix_challenge_participant_rank."""
+    ahead = db.session.query(db.func.count()).filter(
+        ChallengeParticipant.challenge_id == challenge_id,
+        ChallengeParticipant.days_completed > days_completed
+    ).scalar()
+    ahead += db.session.query(db.func.count()).filter(
+        ChallengeParticipant.challenge_id == challenge_id,
+        ChallengeParticipant.days_completed == days_completed,
+        ChallengeParticipant.current_streak > current_streak
+    ).scalar()
+    return ahead + 1
+
+def can_view_challenge(user_id, challenge):
+    group = challenge.group
+    if not group.is_private or group.created_by == user_id:
+        return True
+    return GroupMember.query.filter_by(group_id=group.id, user_id=user_id).first() is not None
+
+# Daily rollups
+ROLLUP_FIELDS = ['completed', 'skipped', 'missed', 'total_value', 'total_duration', 'mood_total', 'mood_count']
+
+def rollup_contribution(status, value=None, duration_minutes=None, mood=None):
+    # What a single log adds to its day's rollup row
+    return {
+        'completed': 1 if status == 'completed' else 0,
+        'skipped': 1 if status == 'skipped' else 0,
+        'missed': 1 if status == 'missed' else 0,
+        'total_value': value or 0,
+        'total_duration': duration_minutes or 0,
+        'mood_total': mood or 0,
+        'mood_count': 1 if mood is not None else 0
+    }
+
+def adjust_rollup(user_id, habit_id, day, contribution, sign=1):
+    rollup = DailyRollup.query.get((user_id, day, habit_id))
+    if rollup is None:
+        rollup = DailyRollup(user_id=user_id, day=day, habit_id=habit_id, **{field: 0 for field in ROLLUP_FIELDS})
+        db.session.add(rollup)
+    
+    for field, amount in contribution.items():
+        setattr(rollup, field, getattr(rollup, field) + sign * amount)
+
+def rebuild_daily_rollups(user_ids=None, habit_ids=None, days=None):
+    """Regenerate rollup rows from the raw logs, optionally limited to some
+    users, habits or days. Returns the number of rows written.
+    """
+    def count_status(status):
+        return db.func.sum(db.case((HabitLog.status == status, 1), else_=0))
+    
+    source = db.session.query(
+        Habit.user_id,
+        HabitLog.day,
+        HabitLog.habit_id,
+        count_status('completed'),
+        count_status('skipped'),
+        count_status('missed'),
+        db.func.coalesce(db.func.sum(HabitLog.value), 0),
+        db.func.coalesce(db.func.sum(HabitLog.duration_minutes), 0),
+        db.func.coalesce(db.func.sum(HabitLog.mood), 0),
+        db.func.count(HabitLog.mood)
+    ).join(Habit, Habit.id == HabitLog.habit_id).group_by(Habit.user_id, HabitLog.day, HabitLog.habit_id)
+    
+    stale = DailyRollup.query
+    if user_ids is not None:
+        source = source.filter(Habit.user_id.in_(user_ids))
+        stale = stale.filter(DailyRollup.user_id.in_(user_ids))
+    if habit_ids is not None:
+        source = source.filter(HabitLog.habit_id.in_(habit_ids))
+        stale = stale.filter(DailyRollup.habit_id.in_(habit_ids))
+    if days is not None:
+        source = source.filter(HabitLog.day.in_(days))
+        stale = stale.filter(DailyRollup.day.in_(days))
+    
+    stale.delete(synchronize_session=False)
+    result = db.session.execute(
+        db.insert(DailyRollup).from_select(['user_id', 'day', 'habit_id'] + ROLLUP_FIELDS, source.statement)
+    )
+    return result.rowcount
+
+def rebucket_log_days(before=None):
+    """Move logs to the local day of their completed_at in their user's timezone, and rebuild what derives from them.
+    
+    For logs whose day was filled in as the UTC date; before (a UTC datetime)
+    limits it to logs completed earlier, so days chosen by clients since are
+    left alone. Returns the number of logs moved.
+    """
+    query = db.session.query(HabitLog.id, HabitLog.habit_id, HabitLog.day, HabitLog.completed_at, User.id, User.timezone).join(
+        Habit, Habit.id == HabitLog.habit_id
+    ).join(User, User.id == Habit.user_id).filter(HabitLog.completed_at.isnot(None))
+    if before is not None:
+        query = query.filter(HabitLog.completed_at < before)
+    
+    moves, habit_ids, user_ids = [], set(), set()
+    for log_id, habit_id, day, completed_at, user_id, tz_name in query.yield_per(1000):
+        local_day = completed_at.replace(tzinfo=timezone.utc).astimezone(get_zone(tz_name)).date()
+        if local_day != day:
+            moves.append({'id': log_id, 'day': local_day})
+            habit_ids.add(habit_id)
+            user_ids.add(user_id)
+    
+    for start in range(0, len(moves), 1000):
+        db.session.execute(db.update(HabitLog), moves[start:start + 1000])
+    if moves:
+        rebuild_habit_streaks(list(habit_ids))
+        rebuild_daily_rollups(user_ids=list(user_ids))
+        rebuild_user_stats(list(user_ids))
+        rebuild_challenge_counters(habit_ids=list(habit_ids))
+        if app.config['BITSET_HISTORY']:
+            rebuild_year_bits(list(habit_ids))
+        for user in User.query.filter(User.id.in_(user_ids)):
+            bump_data_version(user)
+    return len(moves)
+
+# Analytics
+def get_dashboard_stats(user_id, today):
+    """Month-window completion counts for the dashboard from one grouped rollup query.
+    
+    Returns (totals, per_habit, best_day) where totals holds the today/week/month
+    completed counts and per_habit maps habit_id -> (monthly completions, total value).
+    """
+    totals = {'today': 0, 'week': 0, 'month': 0}
+    week_ago = today - timedelta(days=7)
+    month_ago = today - timedelta(days=30)
+    week_days = [week_ago + timedelta(days=offset) for offset in range(8)]
+    
+    def completed_on(day):
+        return db.func.sum(db.case((DailyRollup.day == day, DailyRollup.completed), else_=0))
+    
+    # Reads at most one rollup row per habit per day in the window
+    rows = db.session.query(
+        DailyRollup.habit_id,
+        db.func.sum(DailyRollup.completed),
+        db.func.sum(DailyRollup.total_value),
+        *[completed_on(day) for day in week_days]
+    ).filter(
+        DailyRollup.user_id == user_id,
+        DailyRollup.day >= month_ago
+    ).group_by(DailyRollup.habit_id).all()
+    
+    per_habit = {}
+    day_completion = [0] * len(week_days)
+    for habit_id, month_completed, total_value, *week_counts in rows:
+        per_habit[habit_id] = (month_completed, total_value)
+        totals['month'] += month_completed
+        for index, count in enumerate(week_counts):
+            day_completion[index] += count
+    
+    totals['today'] = day_completion[-1]
+    totals['week'] = sum(day_completion)
+    
+    # Best day of week over the last 7 days (today and a week ago share a weekday)
+    weekday_completion = {}
+    for day, count in zip(week_days, day_completion):
+        if count:
+            day_name = day.strftime('%A')
+            weekday_completion[day_name] = weekday_completion.get(day_name, 0) + count
+    best_day = max(weekday_completion.items(), key=lambda x: x[1])[0] if weekday_completion else None
+    
+    return totals, per_habit, best_day
+
+def load_completion_matrix(user_id, habit_ids, start=None, end=None):
+    """The user's rollups from start to end (default: all of them) in one query, as a CompletionMatrix."""
+    # Days come back as ISO text, which numpy parses in bulk
+    query = db.session.query(
+        DailyRollup.habit_id, db.cast(DailyRollup.day, db.String),
+        *[getattr(DailyRollup, name) for name in ROLLUP_FIELDS]
+    ).filter(DailyRollup.user_id == user_id)
+    if start:
+        query = query.filter(DailyRollup.day >= start)
+    if end:
+        query = query.filter(DailyRollup.day <= end)
+    return CompletionMatrix.from_rollups(habit_ids, query.all(), start, end)
+
+def user_completion_matrix(user, etag, today):
+    """The user's whole history as a CompletionMatrix, loaded once per data version and day."""
+    matrix = matrix_cache.get(etag)
+    if matrix is None:
+        version = matrix_cache.tag_version(user.id)
+        habit_ids = [habit_id for (habit_id,) in db.session.query(Habit.id).filter(Habit.user_id == user.id).order_by(Habit.id)]
+        matrix = load_completion_matrix(user.id, habit_ids, end=today)
+        # Like cache_response: a replica may lag the version in the ETag
+        if db.session.info.get('replica') is None:
+            matrix_cache.set(etag, matrix, tag=user.id, version=version)
+    return matrix
+
+CALENDAR_PAGE_DAYS = 31
+CALENDAR_MAX_PAGE_DAYS = 366
+
+def calendar_log_filters(user_id, start, end, after):
+    filters = [Habit.user_id == user_id]
+    if start:
+        filters.append(HabitLog.day >= start)
+    if end:
+        filters.append(HabitLog.day <= end)
+    if after:
+        filters.append(HabitLog.day > after)
+    return filters
+
+def calendar_notes(user_id, start, end):
+    """Notes of the window's logs by (habit_id, day); the rollups don't keep them."""
+    rows = db.session.query(HabitLog.habit_id, HabitLog.day, HabitLog.notes).join(
+        Habit, Habit.id == HabitLog.habit_id
+    ).filter(
+        *calendar_log_filters(user_id, start, end, None), HabitLog.notes.isnot(None), HabitLog.notes != ''
+    ).order_by(HabitLog.id)
+    return {(habit_id, day): notes for habit_id, day, notes in rows}
+
+def stream_calendar_logs(filters, last_day, next_after):
+    """Yield the calendar JSON a day at a time from a streaming cursor.
+    
+    Only the logs of the day being written are held in memory.
+    """
+    rows = db.session.query(
+        HabitLog.day,
+        HabitLog.habit_id,
+        Habit.name,
+        HabitLog.status,
+        HabitLog.value,
+        HabitLog.notes
+    ).join(Habit, Habit.id == HabitLog.habit_id).filter(
+        *filters, HabitLog.day <= last_day
+    ).order_by(HabitLog.day, HabitLog.id).yield_per(500)
+    
+    yield '{"days": {'
+    separator = ''
+    current_day, day_data = None, None
+    for row in rows:
+        if row.day != current_day:
+            if day_data:
+                yield f'{separator}{json.dumps(current_day.isoformat())}: {json.dumps(day_data)}'
+                separator = ', '
+            current_day = row.day
+            day_data = {'completed': 0, 'skipped': 0, 'missed': 0, 'habits': []}
+        
+        if row.status in ('completed', 'skipped', 'missed'):
+            day_data[row.status] += 1
+        day_data['habits'].append({
+            'habit_id': row.habit_id,
+            'habit_name': row.name,
+            'status': row.status,
+            'value': row.value,
+            'notes': row.notes
+        })
+    
+    if day_data:
+        yield f'{separator}{json.dumps(current_day.isoformat())}: {json.dumps(day_data)}'
+    yield f'}}, "next_after": {json.dumps(next_after)}}}'
+
+EXPORT_FIELDS = ['log_id', 'habit_id', 'habit_name', 'category', 'habit_type', 'unit', 'day', 'status',
+                 'value', 'duration_minutes', 'mood', 'notes', 'completed_at']
+EXPORT_CHUNK_ROWS = 1000
+
+def export_log_rows(user_id, since=None):
+    """Every log of the user joined to its habit and category, oldest first.
+    
+    Rows come off a server-side cursor EXPORT_CHUNK_ROWS at a time.
+    """
+    query = db.session.query(
+        HabitLog.id,
+        HabitLog.habit_id,
+        Habit.name,
+        db.func.coalesce(Category.name, Habit.custom_category),
+        Habit.habit_type,
+        Habit.unit,
+        HabitLog.day,
+        HabitLog.status,
+        HabitLog.value,
+        HabitLog.duration_minutes,
+        HabitLog.mood,
+        HabitLog.notes,
+        HabitLog.completed_at
+    ).join(
+        Habit, Habit.id == HabitLog.habit_id
+    ).outerjoin(
+        Category, Habit.category_id == Category.id
+    ).filter(Habit.user_id == user_id)
+    
+    if since:
+        query = query.filter(HabitLog.completed_at >= since)
+    
+    for row in query.order_by(HabitLog.completed_at, HabitLog.id).yield_per(EXPORT_CHUNK_ROWS):
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['day'] = record['day'].isoformat() if record['day'] else None
+        record['completed_at'] = record['completed_at'].isoformat() if record['completed_at'] else None
+        yield record
+
+def stream_export_ndjson(records):
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record) + '\n')
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+def stream_export_csv(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for count, record in enumerate(records, 1):
+        writer.writerow(record)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def parse_import_records(stream, import_format):
+    """Yield one dict per CSV row or NDJSON line without reading the whole file."""
+    if import_format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+def optional_field(record, field, cast):
+    value = record.get(field)
+    return None if value in (None, '') else cast(value)
+
+def log_measurements(record):
+    """value, duration_minutes and mood of an imported row or batch entry, cast to their columns' types.
+    
+    Raises TypeError or ValueError for a field that doesn't cast.
+    """
+    return {
+        'value': optional_field(record, 'value', float),
+        'duration_minutes': optional_field(record, 'duration_minutes', int),
+        'mood': optional_field(record, 'mood', int)
+    }
+
+def import_history(user_id, records, progress=None):
+    """Bulk-load logs exported from another tracker (or from /api/export).
+    
+    Rows are matched to the user's habits by habit_id, else by habit_name, and
+    habits that don't exist yet are created. A row for a day the habit already
+    has a log for, or that an earlier row in the file covered, is skipped. Logs go in with one executemany per chunk of
+    IMPORT_CHUNK_ROWS and each chunk is committed on its own, so SQLite is only
+    locked a chunk at a time; streaks, rollups, badge counters and XP are then
+    rebuilt once. progress(rows_read, imported, seconds) is called per chunk.
+    """
+    started = clock.perf_counter()
+    chunk_size = app.config['IMPORT_CHUNK_ROWS']
+    user = User.query.get(user_id)
+    zone = get_zone(user.timezone)
+    today = user_today(user)
+    
+    habits_by_name = {name: habit_id for habit_id, name in db.session.query(Habit.id, Habit.name).filter_by(user_id=user_id)}
+    owned = set(habits_by_name.values())
+    summary = {'rows': 0, 'imported': 0, 'duplicates': 0, 'rejected': 0, 'habits_created': 0, 'errors': [], 'aborted': None}
+    touched, completed = set(), 0
+    
+    def resolve_habit(record):
+        habit_id = record.get('habit_id')
+        if habit_id not in (None, '') and int(habit_id) in owned:
+            return int(habit_id)
+        name = (record.get('habit_name') or '').strip()
+        if not name:
+            raise ValueError('habit_id or habit_name is required')
+        if name not in habits_by_name:
+            habit = Habit(
+                user_id=user_id,
+                name=name,
+                frequency='daily',
+                custom_category=record.get('category') or None,
+                habit_type=record.get('habit_type') or 'yes_no',
+                unit=record.get('unit') or None
+            )
+            db.session.add(habit)
+            db.session.flush()
+            habits_by_name[name] = habit.id
+            owned.add(habit.id)
+            summary['habits_created'] += 1
+        return habits_by_name[name]
+    
+    def write_chunk(chunk):
+        nonlocal completed
+        if chunk:
+            days = [day for _, day in chunk]
+            existing = set(db.session.query(HabitLog.habit_id, HabitLog.day).filter(
+                HabitLog.habit_id.in_({habit_id for habit_id, _ in chunk}),
+                HabitLog.day.between(min(days), max(days))
+            ))
+            rows = [row for key, row in chunk.items() if key not in existing]
+            summary['duplicates'] += len(chunk) - len(rows)
+            if rows:
+                db.session.execute(db.insert(HabitLog), rows)
+            summary['imported'] += len(rows)
+            completed += sum(1 for row in rows if row['status'] == 'completed')
+            touched.update(row['habit_id'] for row in rows)
+        db.session.commit()
+        if progress:
+            progress(summary['rows'], summary['imported'], clock.perf_counter() - started)
+    
+    chunk = {}
+    try:
+        for record in records:
+            summary['rows'] += 1
+            try:
+                completed_at = optional_field(record, 'completed_at', datetime.fromisoformat)
+                if record.get('day'):
+                    day = datetime.strptime(record['day'], '%Y-%m-%d').date()
+                elif completed_at is not None:
+                    day = (completed_at if completed_at.tzinfo else completed_at.replace(tzinfo=timezone.utc)).astimezone(zone).date()
+                else:
+                    raise ValueError('day or completed_at is required')
+                status = record.get('status') or 'completed'
+                if status not in LOG_STATUSES:
+                    raise ValueError(f'unknown status {status!r}')
+                if day > today:
+                    raise ValueError('day is in the future')
+                
+                # Without a timestamp, count the log at local noon
+                if completed_at is None:
+                    completed_at = datetime.combine(day, time(12), tzinfo=zone)
+                elif completed_at.tzinfo is None:
+                    completed_at = completed_at.replace(tzinfo=timezone.utc)
+                
+                row = {
+                    'day': day,
+                    'status': status,
+                    **log_measurements(record),
+                    'notes': record.get('notes') or None,
+                    'completed_at': completed_at.astimezone(timezone.utc).replace(tzinfo=None)
+                }
+                # Last, once nothing else can reject the row, so a rejected row never creates a habit
+                row['habit_id'] = resolve_habit(record)
+                # The first row for a habit's day wins, as it does against logs already stored
+                if (row['habit_id'], day) in chunk:
+                    summary['duplicates'] += 1
+                    continue
+                chunk[(row['habit_id'], day)] = row
+            except (TypeError, ValueError, AttributeError) as error:
+                summary['rejected'] += 1
+                if len(summary['errors']) < 20:
+                    summary['errors'].append(f"row {summary['rows']}: {error}")
+                continue
+            
+            if len(chunk) >= chunk_size:
+                write_chunk(chunk)
+                chunk = {}
+    except (ValueError, csv.Error) as error:
+        # A line that can't be parsed at all ends the import; what came before it is kept
+        summary['aborted'] = f"row {summary['rows'] + 1}: {error}"
+    write_chunk(chunk)
+    
+    # Derived data once for everything that was imported
+    user = User.query.get(user_id)
+    badges_earned = []
+    if touched:
+        bump_data_version(user)
+        rebuild_habit_streaks(list(touched))
+        rebuild_daily_rollups(user_ids=[user_id], habit_ids=list(touched))
+        rebuild_user_stats([user_id])
+        rebuild_challenge_counters(habit_ids=list(touched))
+        if app.config['BITSET_HISTORY']:
+            rebuild_year_bits(list(touched))
+        if completed:
+            award_xp(user, 10 * completed, f"{completed} imported completions")
+        badges_earned = [badge.name for badge in evaluate_badges(user, get_user_stats(user_id))]
+        db.session.commit()
+    
+    summary['badges_earned'] = badges_earned
+    summary['seconds'] = round(clock.perf_counter() - started, 3)
+    summary['rows_per_second'] = round(summary['rows'] / summary['seconds']) if summary['seconds'] else summary['rows']
+    return summary
+
+# Insights (generated by the generate-insights command, see insights.py)
+INSIGHT_RECENT_DAYS = 14  # drop-offs compare this many days...
+INSIGHT_EARLIER_DAYS = 28  # ...against this many before them
+INSIGHT_REPEAT_AFTER = timedelta(days=7)  # an insight the user has read isn't repeated sooner
+
+def generate_insights(user_ids=None, today=None):
+    """Recompute every user's pattern insights from the daily rollups. Returns a summary.
+    
+    Users are taken INSIGHT_CHUNK_USERS at a time: two aggregate queries per
+    chunk, then the chunk's unread insights are replaced with one bulk insert.
+    """
+    started = clock.perf_counter()
+    now = datetime.utcnow()
+    end = (today or now.date()) - timedelta(days=1)  # Last complete day
+    start = end - timedelta(days=app.config['INSIGHT_WINDOW_DAYS'] - 1)
+    recent_start = end - timedelta(days=INSIGHT_RECENT_DAYS - 1)
+    earlier_start = recent_start - timedelta(days=INSIGHT_EARLIER_DAYS)
+    
+    users = db.session.query(User.id).filter(User.is_active == True)
+    if user_ids is not None:
+        users = users.filter(User.id.in_(user_ids))
+    
+    summary = {'users': 0, 'insights': 0}
+    last_id = 0
+    while True:
+        chunk = [user_id for (user_id,) in users.filter(User.id > last_id).order_by(User.id).limit(app.config['INSIGHT_CHUNK_USERS'])]
+        if not chunk:
             break
+        last_id = chunk[-1]
+        
+        daily = {}
+        for user_id, day, completed, mood_total, mood_count in db.session.query(
+            DailyRollup.user_id, DailyRollup.day, db.func.sum(DailyRollup.completed),
+            db.func.sum(DailyRollup.mood_total), db.func.sum(DailyRollup.mood_count)
+        ).filter(
+            DailyRollup.user_id.in_(chunk),
+            DailyRollup.day.between(start, end)
+        ).group_by(DailyRollup.user_id, DailyRollup.day):
+            daily.setdefault(user_id, {})[day] = (completed, mood_total / mood_count if mood_count else None)
+        
+        habits = {}
+        for user_id, name, recent, earlier in db.session.query(
+            DailyRollup.user_id, Habit.name,
+            db.func.sum(db.case((DailyRollup.day >= recent_start, DailyRollup.completed), else_=0)),
+            db.func.sum(db.case((DailyRollup.day < recent_start, DailyRollup.completed), else_=0))
+        ).join(Habit, Habit.id == DailyRollup.habit_id).filter(
+            DailyRollup.user_id.in_(chunk),
+            DailyRollup.day.between(earlier_start, end),
+            Habit.is_active == True
+        ).group_by(DailyRollup.user_id, DailyRollup.habit_id, Habit.name):
+            habits.setdefault(user_id, []).append((name, recent, earlier))
+        
+        recently_read = set(db.session.query(AIInsight.user_id, AIInsight.title).filter(
+            AIInsight.user_id.in_(chunk),
+            AIInsight.is_read == True,
+            AIInsight.created_at >= now - INSIGHT_REPEAT_AFTER
+        ))
+        rows = []
+        for user_id in chunk:
+            for insight in build_insights(daily.get(user_id, {}), habits.get(user_id, []), start, end,
+                                          INSIGHT_RECENT_DAYS, INSIGHT_EARLIER_DAYS):
+                if (user_id, insight['title']) not in recently_read:
+                    rows.append(dict(insight, user_id=user_id, created_at=now, is_read=False))
+        
+        # The previous run's unread insights are superseded, not piled up
+        AIInsight.query.filter(AIInsight.user_id.in_(chunk), AIInsight.is_read == False).delete(synchronize_session=False)
+        if rows:
+            db.session.execute(db.insert(AIInsight), rows)
+        db.session.commit()
+        
+        summary['users'] += len(chunk)
+        summary['insights'] += len(rows)
     
-    longest_streak = temp_streak
+    summary['seconds'] = round(clock.perf_counter() - started, 3)
+    return summary
+
+# Reminders (fired by the run-reminders command, see scheduler.py)
+def load_scheduled_reminders():
+    """Every active reminder of an active habit, resolved for ReminderScheduler."""
+    rows = db.session.query(
+        Reminder.id, Reminder.habit_id, Habit.user_id, Habit.name, Reminder.time, Reminder.days,
+        User.timezone, Reminder.is_smart, Reminder.cutoff_time
+    ).join(Habit, Habit.id == Reminder.habit_id).join(User, User.id == Habit.user_id).filter(
+        Reminder.is_active == True, Habit.is_active == True, User.is_active == True
+    )
     
-    return current_streak, longest_streak
+    zones = {}
+    reminders = []
+    for reminder_id, habit_id, user_id, name, at, days, tz_name, is_smart, cutoff_time in rows:
+        if tz_name not in zones:
+            zones[tz_name] = get_zone(tz_name)
+        try:
+            weekdays = parse_weekdays(days)
+        except (ValueError, TypeError):
+            app.logger.warning('Reminder %s has unreadable days %r; skipped', reminder_id, days)
+            continue
+        reminders.append(ScheduledReminder(reminder_id, habit_id, user_id, name, at, weekdays, zones[tz_name], bool(is_smart), cutoff_time))
+    db.session.rollback()  # Don't hold a read transaction open between reloads
+    return reminders
+
+def habits_done_on(keys):
+    """The (habit_id, local day) pairs in keys that already have a completed or skipped log."""
+    habit_ids = {habit_id for habit_id, _ in keys}
+    days = {day for _, day in keys}
+    rows = db.session.query(HabitLog.habit_id, HabitLog.day).filter(
+        HabitLog.habit_id.in_(habit_ids), HabitLog.day.in_(days), HabitLog.status.in_(('completed', 'skipped'))
+    )
+    done = {(habit_id, day) for habit_id, day in rows} & keys
+    db.session.rollback()
+    return done
 
 # Authentication Routes
 @app.route('/api/auth/register', methods=['POST'])
@@ -302,10 +1505,17 @@ def register():
     if User.query.filter_by(username=data['username']).first():
         return jsonify({'error': 'Username already exists'}), 400
     
+    tz_name = data.get('timezone', 'UTC')
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return jsonify({'error': 'Unknown timezone'}), 400
+    
     user = User(
         username=data['username'],
         email=data['email'],
-        password_hash=generate_password_hash(data['password'])
+        password_hash=generate_password_hash(data['password']),
+        timezone=tz_name
     )
     
     db.session.add(user)
@@ -375,18 +1585,27 @@ def get_habits():
     if not user:
         return jsonify({'error': 'Invalid token'}), 401
     
-    habits = Habit.query.filter_by(user_id=user.id, is_active=True).order_by(Habit.order, Habit.is_pinned.desc()).all()
+    user, etag = data_etag(user)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    rows = db.session.query(Habit, Category.name).outerjoin(
+        Category, Habit.category_id == Category.id
+    ).filter(
+        Habit.user_id == user.id,
+        Habit.is_active == True
+    ).order_by(Habit.order, Habit.is_pinned.desc()).all()
+    
+    today = user_today(user)
+    habit_ids = [habit.id for habit, _ in rows]
+    streaks = get_habit_streaks(habit_ids, today)
+    today_logs = get_today_logs(habit_ids, today)
     
     result = []
-    for habit in habits:
-        current_streak, longest_streak = get_habit_streak(habit.id)
-        
-        # Check today's status
-        today = date.today()
-        today_log = HabitLog.query.filter(
-            HabitLog.habit_id == habit.id,
-            db.func.date(HabitLog.completed_at) == today
-        ).first()
+    for habit, category_name in rows:
+        current_streak, longest_streak = streaks[habit.id]
+        today_log = today_logs.get(habit.id)
         
         # Get progress for measurable habits
         progress = None
@@ -401,7 +1620,7 @@ def get_habits():
             'id': habit.id,
             'name': habit.name,
             'description': habit.description,
-            'category': Category.query.get(habit.category_id).name if habit.category_id else habit.custom_category,
+            'category': category_name if habit.category_id else habit.custom_category,
             'frequency': habit.frequency,
             'repeat_days': json.loads(habit.repeat_days) if habit.repeat_days else None,
             'habit_type': habit.habit_type,
@@ -417,7 +1636,7 @@ def get_habits():
             'created_at': habit.created_at.isoformat()
         })
     
-    return jsonify(result)
+    return with_etag(jsonify(result), etag)
 
 @app.route('/api/habits', methods=['POST'])
 def create_habit():
@@ -429,6 +1648,8 @@ def create_habit():
     if not user:
         return jsonify({'error': 'Invalid token'}), 401
     
+    user = User.query.get(user.id)  # This request awards XP
+    bump_data_version(user)
     data = request.get_json()
     
     habit = Habit(
@@ -439,7 +1660,7 @@ def create_habit():
         custom_category=data.get('custom_category'),
         frequency=data.get('frequency', 'daily'),
         repeat_days=json.dumps(data.get('repeat_days', [])),
-        start_date=datetime.strptime(data.get('start_date'), '%Y-%m-%d').date() if data.get('start_date') else date.today(),
+        start_date=datetime.strptime(data.get('start_date'), '%Y-%m-%d').date() if data.get('start_date') else user_today(user),
         end_date=datetime.strptime(data['end_date'], '%Y-%m-%d').date() if data.get('end_date') else None,
         habit_type=data.get('habit_type', 'yes_no'),
         target_value=data.get('target_value', 1.0),
@@ -452,10 +1673,10 @@ def create_habit():
     )
     
     db.session.add(habit)
-    db.session.commit()
     
     # Award XP for creating habit
-    award_xp(user.id, 5, "New habit created")
+    award_xp(user, 5, "New habit created")
+    db.session.commit()
     
     return jsonify({'message': 'Habit created successfully', 'habit_id': habit.id}), 201
 
@@ -473,17 +1694,26 @@ def complete_habit(habit_id):
     if habit.user_id != user.id:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    user = User.query.get(user.id)  # This request changes XP, coins and badges
+    bump_data_version(user)
     data = request.get_json()
     status = data.get('status', 'completed')
     
-    # Check if already logged today
-    today = date.today()
+    # Check if already logged today, in the user's own timezone
+    today = user_today(user)
     existing_log = HabitLog.query.filter(
         HabitLog.habit_id == habit_id,
-        db.func.date(HabitLog.completed_at) == today
+        HabitLog.day == today
     ).first()
     
+    previous_status = existing_log.status if existing_log else None
+    
     if existing_log:
+        # Take the old values back out of the day's rollup before overwriting them
+        adjust_rollup(user.id, habit_id, today, rollup_contribution(
+            existing_log.status, existing_log.value, existing_log.duration_minutes, existing_log.mood
+        ), sign=-1)
+        
         # Update existing log
         existing_log.status = status
         existing_log.value = data.get('value')
@@ -495,6 +1725,7 @@ def complete_habit(habit_id):
         # Create new log
         log = HabitLog(
             habit_id=habit_id,
+            day=today,
             status=status,
             value=data.get('value'),
             notes=data.get('notes'),
@@ -503,14 +1734,42 @@ def complete_habit(habit_id):
         )
         db.session.add(log)
     
-    db.session.commit()
+    adjust_rollup(user.id, habit_id, today, rollup_contribution(
+        status, data.get('value'), data.get('duration_minutes'), data.get('mood')
+    ))
+    
+    streak = record_streak_log(habit, today, previous_status, status)
+    
+    stats = get_user_stats(user.id)
+    local_time = datetime.now(get_zone(user.timezone)).time()
+    record_completion_stats(stats, previous_status, status, today, streak, local_time)
+    record_challenge_logs({(habit_id, today): (previous_status, status)})
+    record_year_bits({(habit_id, today): status})
     
     # Award XP and check badges
+    badges_earned = []
     if status == 'completed':
-        award_xp(user.id, 10, f"Habit completed: {habit.name}")
-        check_badges(user.id)
+        award_xp(user, 10, f"Habit completed: {habit.name}")
+        badges_earned = evaluate_badges(user, stats)
     
-    current_streak, longest_streak = get_habit_streak(habit_id)
+    current_streak, longest_streak = get_habit_streak(habit_id, today)
+    
+    # Deltas for the user's other open tabs, sent only if the commit goes through
+    queue_event(user.id, 'habit_logged', {
+        'habit_id': habit_id,
+        'day': today.isoformat(),
+        'is_today': True,
+        'status': status,
+        'value': data.get('value'),
+        'current_streak': current_streak,
+        'longest_streak': longest_streak
+    })
+    queue_event(user.id, 'progress', progress_event(user))
+    for badge in badges_earned:
+        queue_event(user.id, 'badge_earned', {'name': badge.name, 'description': badge.description, 'icon': badge.icon})
+    
+    # Log, rollup, streak, counters, XP and badges land in one transaction
+    db.session.commit()
     
     return jsonify({
         'message': 'Habit logged successfully',
@@ -519,9 +1778,11 @@ def complete_habit(habit_id):
         'longest_streak': longest_streak
     })
 
-# Analytics Routes
-@app.route('/api/analytics/dashboard', methods=['GET'])
-def get_analytics_dashboard():
+LOG_STATUSES = ('completed', 'skipped', 'missed')
+
+@app.route('/api/habits/complete/batch', methods=['POST'])
+def complete_habits_batch():
+    """Log many (habit, day) entries at once, e.g. completions replayed by an offline client."""
     token = request.headers.get('Authorization')
     if not token:
         return jsonify({'error': 'No token provided'}), 401
@@ -530,59 +1791,257 @@ def get_analytics_dashboard():
     if not user:
         return jsonify({'error': 'Invalid token'}), 401
     
-    # Time periods
-    today = date.today()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
+    entries = (request.get_json() or {}).get('entries')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'entries must be a non-empty list'}), 400
+    if len(entries) > app.config['MAX_BATCH_ENTRIES']:
+        return jsonify({'error': f"At most {app.config['MAX_BATCH_ENTRIES']} entries per batch"}), 400
+    
+    today = user_today(user)
+    zone = get_zone(user.timezone)
+    now = datetime.utcnow()
+    
+    # Later entries for the same habit and day replace earlier ones; invalid
+    # entries are left out and reported by index, under the importer's rules
+    batch, rejected = {}, []
+    for index, entry in enumerate(entries):
+        try:
+            if not isinstance(entry, dict):
+                raise TypeError('entry must be an object')
+            if entry.get('habit_id') in (None, ''):
+                raise ValueError('habit_id is required')
+            habit_id = int(entry['habit_id'])
+            day = datetime.strptime(entry['day'], '%Y-%m-%d').date() if entry.get('day') else today
+            completed_at = optional_field(entry, 'completed_at', datetime.fromisoformat)
+            status = entry.get('status') or 'completed'
+            if status not in LOG_STATUSES:
+                raise ValueError(f'unknown status {status!r}')
+            if day > today:
+                raise ValueError('day is in the future')
+            measurements = log_measurements(entry)
+        except (TypeError, ValueError, AttributeError) as error:
+            rejected.append({'index': index, 'error': str(error)})
+            continue
+        
+        # Only an explicit timestamp says when in the user's day it happened
+        local_time = None
+        if completed_at is not None:
+            if completed_at.tzinfo is None:
+                completed_at = completed_at.replace(tzinfo=timezone.utc)
+            local_time = completed_at.astimezone(zone).time()
+            completed_at = completed_at.astimezone(timezone.utc).replace(tzinfo=None)
+        
+        batch[(habit_id, day)] = ({
+            'status': status,
+            **measurements,
+            'notes': entry.get('notes'),
+            'completed_at': completed_at or now
+        }, local_time)
+    
+    if not batch:
+        return jsonify({'error': 'No valid entries', 'rejected': rejected}), 400
+    
+    # Ownership of every habit in one query
+    habit_ids = {habit_id for habit_id, _ in batch}
+    owned = {habit_id for (habit_id,) in db.session.query(Habit.id).filter(
+        Habit.id.in_(habit_ids),
+        Habit.user_id == user.id
+    )}
+    if owned != habit_ids:
+        return jsonify({'error': 'Unauthorized', 'habit_ids': sorted(habit_ids - owned)}), 403
+    
+    user = User.query.get(user.id)  # This request changes XP, coins and badges
+    bump_data_version(user)
+    days = {day for _, day in batch}
+    
+    existing = {}
+    for log_id, habit_id, day, status in db.session.query(
+        HabitLog.id, HabitLog.habit_id, HabitLog.day, HabitLog.status
+    ).filter(
+        HabitLog.habit_id.in_(habit_ids),
+        HabitLog.day.in_(days)
+    ).order_by(HabitLog.id):
+        if (habit_id, day) in batch:
+            existing.setdefault((habit_id, day), (log_id, status))
+    
+    # Upsert the logs with one executemany each
+    inserts, updates = [], []
+    for (habit_id, day), (values, _) in batch.items():
+        if (habit_id, day) in existing:
+            updates.append(dict(values, id=existing[(habit_id, day)][0]))
+        else:
+            inserts.append(dict(values, habit_id=habit_id, day=day))
+    if inserts:
+        db.session.execute(db.insert(HabitLog), inserts)
+    if updates:
+        db.session.execute(db.update(HabitLog), updates)
+    
+    rebuild_daily_rollups(habit_ids=list(habit_ids), days=list(days))
+    
+    # Streaks: advance in day order, or recompute habits where that isn't enough
+    streaks = {streak.habit_id: streak for streak in HabitStreak.query.filter(HabitStreak.habit_id.in_(habit_ids))}
+    needs_rebuild = {
+        habit_id for (habit_id, day), (_, previous_status) in existing.items()
+        if previous_status == 'completed' and batch[(habit_id, day)][0]['status'] != 'completed'
+    }
+    needs_rebuild.update(habit_id for (habit_id,) in db.session.query(Habit.id).filter(
+        Habit.id.in_(habit_ids),
+        db.or_(Habit.allow_skips == True, Habit.max_misses_per_week > 0)
+    ))
+    completed_days = {}
+    for habit_id, day in sorted(batch, key=lambda key: key[1]):
+        if batch[(habit_id, day)][0]['status'] == 'completed':
+            completed_days.setdefault(habit_id, []).append(day)
+    for habit_id, habit_days in completed_days.items():
+        streak = streaks.get(habit_id)
+        if streak is not None and streak.last_completed_day and habit_days[0] < streak.last_completed_day:
+            needs_rebuild.add(habit_id)
+        if habit_id not in needs_rebuild:
+            for day in habit_days:
+                record_streak_completion(habit_id, day)
+    if needs_rebuild:
+        rebuild_habit_streaks(list(needs_rebuild))
+    
+    # Counters, XP and badges once for the whole batch
+    stats = get_user_stats(user.id)
+    newly_completed = 0
+    for (habit_id, day), (values, local_time) in sorted(batch.items(), key=lambda item: item[0][1]):
+        previous_status = existing.get((habit_id, day), (None, None))[1]
+        if values['status'] == 'completed' and previous_status != 'completed':
+            newly_completed += 1
+        streak = HabitStreak.query.get(habit_id) if values['status'] == 'completed' else None
+        record_completion_stats(stats, previous_status, values['status'], day, streak, local_time)
+    record_challenge_logs({
+        key: (existing.get(key, (None, None))[1], values['status'])
+        for key, (values, _) in batch.items()
+    })
+    record_year_bits({key: values['status'] for key, (values, _) in batch.items()})
+    
+    # Replaying an already-completed day earns nothing, so retries are safe
+    if newly_completed:
+        award_xp(user, 10 * newly_completed, f"{newly_completed} habits completed")
+    earned = evaluate_badges(user, stats)
+    badges_earned = [badge.name for badge in earned]
+    
+    streak_results = get_habit_streaks(list(habit_ids), today)
+    
+    # One delta per habit, for the latest day the batch logged
+    latest = {}
+    for habit_id, day in sorted(batch, key=lambda key: key[1]):
+        latest[habit_id] = day
+    for habit_id, day in latest.items():
+        values = batch[(habit_id, day)][0]
+        current_streak, longest_streak = streak_results[habit_id]
+        queue_event(user.id, 'habit_logged', {
+            'habit_id': habit_id,
+            'day': day.isoformat(),
+            'is_today': day == today,
+            'status': values['status'],
+            'value': values['value'],
+            'current_streak': current_streak,
+            'longest_streak': longest_streak
+        })
+    queue_event(user.id, 'progress', progress_event(user))
+    for badge in earned:
+        queue_event(user.id, 'badge_earned', {'name': badge.name, 'description': badge.description, 'icon': badge.icon})
     
-    habit_ids = [h.id for h in user.habits]
+    db.session.commit()
     
-    # Basic stats
-    total_habits = len(habit_ids)
+    return jsonify({
+        'message': 'Habits logged successfully',
+        'created': len(inserts),
+        'updated': len(updates),
+        'newly_completed': newly_completed,
+        'rejected': rejected,
+        'badges_earned': badges_earned,
+        'streaks': {
+            str(habit_id): {'current_streak': current, 'longest_streak': longest}
+            for habit_id, (current, longest) in streak_results.items()
+        }
+    })
+
+@app.route('/api/habits/<int:habit_id>/heatmap', methods=['GET'])
+def get_habit_heatmap(habit_id):
+    """One year of a habit as its completed/skipped bitmaps, with counts taken from the bits."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
     
-    # Today's completion
-    today_logs = HabitLog.query.filter(
-        HabitLog.habit_id.in_(habit_ids),
-        db.func.date(HabitLog.completed_at) == today
-    ).all()
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
     
-    today_completed = len([log for log in today_logs if log.status == 'completed'])
+    habit = Habit.query.get_or_404(habit_id)
+    if habit.user_id != user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
     
-    # Weekly stats
-    week_logs = HabitLog.query.filter(
-        HabitLog.habit_id.in_(habit_ids),
-        HabitLog.completed_at >= week_ago
-    ).all()
+    user, etag = data_etag(user)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    today = user_today(user)
+    year = request.args.get('year', today.year, type=int)
+    completed, skipped = stored_year_bits(habit_id, year).get(year, (0, 0))
+    # The streak records, which follow the habit's skip rules, so every endpoint reports the same streaks
+    current_streak, longest_streak = get_habit_streak(habit_id, today)
+    
+    return with_etag(jsonify({
+        'habit_id': habit_id,
+        'year': year,
+        'encoding': 'base64, little-endian; bit n is day n + 1 of the year',
+        'completed': base64.b64encode(bitset.to_bytes(completed)).decode(),
+        'skipped': base64.b64encode(bitset.to_bytes(skipped)).decode(),
+        'completed_days': completed.bit_count(),
+        'skipped_days': skipped.bit_count(),
+        'monthly_completed': bitset.monthly_counts(completed, year),
+        'current_streak': current_streak,
+        'longest_streak': longest_streak
+    }), etag)
+
+# Analytics Routes
+@app.route('/api/analytics/dashboard', methods=['GET'])
+def get_analytics_dashboard():
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
     
-    week_completed = len([log for log in week_logs if log.status == 'completed'])
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
     
-    # Monthly stats
-    month_logs = HabitLog.query.filter(
-        HabitLog.habit_id.in_(habit_ids),
-        HabitLog.completed_at >= month_ago
-    ).all()
+    user, etag = data_etag(user)
+    cached = not_modified(etag) or cached_response(etag)
+    if cached:
+        return cached
+    
+    read_from_replica()
     
-    month_completed = len([log for log in month_logs if log.status == 'completed'])
+    # Time periods, relative to the user's local day
+    today = user_today(user)
     
-    # Best day of week
-    day_completion = {}
-    for log in week_logs:
-        if log.status == 'completed':
-            day_name = log.completed_at.strftime('%A')
-            day_completion[day_name] = day_completion.get(day_name, 0) + 1
+    habits = db.session.query(Habit.id, Habit.name, Habit.unit).filter(
+        Habit.user_id == user.id
+    ).order_by(Habit.id).all()
+    habit_ids = [habit.id for habit in habits]
     
-    best_day = max(day_completion.items(), key=lambda x: x[1])[0] if day_completion else None
+    # Basic stats
+    total_habits = len(habit_ids)
+    if app.config['ANALYTICS_BACKEND'] == 'numpy':
+        matrix = user_completion_matrix(user, etag, today)
+        totals, per_habit, best_day = matrix.dashboard_stats(today)
+    else:
+        totals, per_habit, best_day = get_dashboard_stats(user.id, today)
+    streaks = get_habit_streaks(habit_ids, today)  # The streak records follow each habit's skip rules
+    today_completed = totals['today']
+    week_completed = totals['week']
+    month_completed = totals['month']
     
     # Habit-wise stats
     habit_stats = []
-    for habit in user.habits:
-        current_streak, longest_streak = get_habit_streak(habit.id)
-        
-        habit_month_logs = [log for log in month_logs if log.habit_id == habit.id]
-        habit_month_completed = len([log for log in habit_month_logs if log.status == 'completed'])
-        
-        # Total value for measurable habits
-        total_value = sum([log.value or 0 for log in habit_month_logs if log.value])
+    for habit in habits:
+        current_streak, longest_streak = streaks[habit.id]
+        habit_month_completed, total_value = per_habit.get(habit.id, (0, 0))
         
         habit_stats.append({
             'id': habit.id,
@@ -594,7 +2053,7 @@ def get_analytics_dashboard():
             'unit': habit.unit
         })
     
-    return jsonify({
+    return cache_response(user, etag, jsonify({
         'overview': {
             'total_habits': total_habits,
             'today_completed': today_completed,
@@ -610,7 +2069,7 @@ def get_analytics_dashboard():
             'xp': user.xp,
             'total_coins': user.total_coins
         }
-    })
+    }))
 
 @app.route('/api/analytics/calendar', methods=['GET'])
 def get_calendar_data():
@@ -622,22 +2081,52 @@ def get_calendar_data():
     if not user:
         return jsonify({'error': 'Invalid token'}), 401
     
-    habit_ids = [h.id for h in user.habits]
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    query = HabitLog.query.filter(HabitLog.habit_id.in_(habit_ids))
+    user, etag = data_etag(user)
+    read_from_replica()
     
-    if start_date:
-        query = query.filter(HabitLog.completed_at >= datetime.strptime(start_date, '%Y-%m-%d'))
-    if end_date:
-        query = query.filter(HabitLog.completed_at <= datetime.strptime(end_date, '%Y-%m-%d'))
+    if request.args.get('mode') == 'stream':
+        return stream_calendar_response(user)
     
-    logs = query.all()
+    cached = not_modified(etag) or cached_response(etag)
+    if cached:
+        return cached
     
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    start = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+    end = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+    
+    if app.config['ANALYTICS_BACKEND'] == 'numpy':
+        habit_names = dict(db.session.query(Habit.id, Habit.name).filter(Habit.user_id == user.id).order_by(Habit.id).all())
+        matrix = user_completion_matrix(user, etag, user_today(user))
+        notes = calendar_notes(user.id, start, end)
+        return cache_response(user, etag, jsonify(matrix.calendar(habit_names, start, end, notes)))
+    
+    # One rollup row per habit per day, so cost follows the days shown, not the log count
+    query = db.session.query(
+        DailyRollup.day,
+        DailyRollup.habit_id,
+        Habit.name,
+        DailyRollup.completed,
+        DailyRollup.skipped,
+        DailyRollup.missed,
+        DailyRollup.total_value,
+        DailyRollup.total_duration,
+        DailyRollup.mood_total,
+        DailyRollup.mood_count
+    ).join(
+        Habit, Habit.id == DailyRollup.habit_id
+    ).filter(DailyRollup.user_id == user.id)
+    
+    if start:
+        query = query.filter(DailyRollup.day >= start)
+    if end:
+        query = query.filter(DailyRollup.day <= end)
+    
+    notes = calendar_notes(user.id, start, end)
     calendar_data = {}
-    for log in logs:
-        date_str = log.completed_at.strftime('%Y-%m-%d')
+    for rollup in query.order_by(DailyRollup.day, DailyRollup.habit_id):
+        date_str = rollup.day.strftime('%Y-%m-%d')
         if date_str not in calendar_data:
             calendar_data[date_str] = {
                 'completed': 0,
@@ -646,16 +2135,161 @@ def get_calendar_data():
                 'habits': []
             }
         
-        calendar_data[date_str][log.status] += 1
-        calendar_data[date_str]['habits'].append({
-            'habit_id': log.habit_id,
-            'habit_name': log.habit.name,
-            'status': log.status,
-            'value': log.value,
-            'notes': log.notes
+        day_data = calendar_data[date_str]
+        day_data['completed'] += rollup.completed
+        day_data['skipped'] += rollup.skipped
+        day_data['missed'] += rollup.missed
+        
+        if rollup.completed:
+            status = 'completed'
+        elif rollup.skipped:
+            status = 'skipped'
+        elif rollup.missed:
+            status = 'missed'
+        else:
+            continue
+        
+        day_data['habits'].append({
+            'habit_id': rollup.habit_id,
+            'habit_name': rollup.name,
+            'status': status,
+            'value': rollup.total_value or None,
+            'notes': notes.get((rollup.habit_id, rollup.day)),
+            'duration_minutes': rollup.total_duration or None,
+            'mood': rollup.mood_total / rollup.mood_count if rollup.mood_count else None
         })
     
-    return jsonify(calendar_data)
+    return cache_response(user, etag, jsonify(calendar_data))
+
+def stream_calendar_response(user):
+    # Per-log calendar, paged by day: ?mode=stream&after=YYYY-MM-DD&limit=<days>
+    try:
+        start = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() if request.args.get('start_date') else None
+        end = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else None
+        after = datetime.strptime(request.args['after'], '%Y-%m-%d').date() if request.args.get('after') else None
+        limit = min(int(request.args.get('limit', CALENDAR_PAGE_DAYS)), CALENDAR_MAX_PAGE_DAYS)
+    except ValueError:
+        return jsonify({'error': 'Invalid date or limit'}), 400
+    
+    if limit < 1:
+        return jsonify({'error': 'Invalid date or limit'}), 400
+    
+    filters = calendar_log_filters(user.id, start, end, after)
+    
+    # Find where this page ends with an index-only scan over distinct days
+    page_days = db.session.query(HabitLog.day).join(
+        Habit, Habit.id == HabitLog.habit_id
+    ).filter(*filters).distinct().order_by(HabitLog.day).limit(limit).subquery()
+    day_count, last_day = db.session.query(db.func.count(), db.func.max(page_days.c.day)).one()
+    
+    if not day_count:
+        return Response('{"days": {}, "next_after": null}', mimetype='application/json')
+    
+    next_after = last_day.isoformat() if day_count == limit else None
+    return Response(
+        stream_with_context(stream_calendar_logs(filters, last_day, next_after)),
+        mimetype='application/json'
+    )
+
+# Import / Export Routes
+@app.route('/api/export', methods=['GET'])
+def export_history():
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
+    
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Format must be ndjson or csv'}), 400
+    
+    # ?since=<ISO timestamp> only exports logs written or changed from then on (inclusive)
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({'error': 'Invalid since timestamp'}), 400
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    records = export_log_rows(user.id, since)
+    if export_format == 'csv':
+        body, mimetype = stream_export_csv(records), 'text/csv'
+    else:
+        body, mimetype = stream_export_ndjson(records), 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=habit-history.{export_format}'}
+    )
+
+@app.route('/api/import', methods=['POST'])
+def import_history_upload():
+    """Import a CSV or NDJSON history, sent as the request body or as a 'file' upload."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
+    
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    upload = request.files.get('file')
+    default_format = 'csv' if (upload.filename if upload else request.mimetype).endswith('csv') else 'ndjson'
+    import_format = request.args.get('format', default_format)
+    if import_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Format must be ndjson or csv'}), 400
+    
+    stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding='utf-8', newline='')
+    
+    def log_progress(rows, imported, seconds):
+        app.logger.info('Import for user %s: %d rows read, %d imported, %.0f rows/s', user.id, rows, imported, rows / seconds)
+    
+    summary = import_history(user.id, parse_import_records(stream, import_format), log_progress)
+    if summary['aborted']:
+        return jsonify(dict(summary, error=f"Could not parse the file at {summary['aborted']}")), 400
+    
+    return jsonify(summary)
+
+# Server-sent events
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """One text/event-stream per open tab: habit_logged, progress and badge_earned deltas."""
+    # EventSource can't set headers, so the token may also come as ?token=
+    token = request.headers.get('Authorization') or request.args.get('token')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
+    
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    user_id = user.id
+    subscription = event_broker.subscribe(user_id)
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n: connected\n\n'
+            while True:
+                try:
+                    event_id, event_type, data = subscription.get(timeout=app.config['EVENT_KEEPALIVE'])
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            event_broker.unsubscribe(user_id, subscription)
+    
+    # No stream_with_context: the stream never touches the database, so it holds no session
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 # Gamification Routes
 @app.route('/api/user/profile', methods=['GET'])
@@ -668,6 +2302,13 @@ def get_user_profile():
     if not user:
         return jsonify({'error': 'Invalid token'}), 401
     
+    user, etag = data_etag(user)
+    cached = not_modified(etag) or cached_response(etag)
+    if cached:
+        return cached
+    
+    read_from_replica()
+    
     # Get user badges
     user_badges = db.session.query(UserBadge, Badge).join(Badge).filter(UserBadge.user_id == user.id).all()
     
@@ -681,12 +2322,7 @@ def get_user_profile():
             'earned_at': user_badge.earned_at.isoformat()
         })
     
-    # Calculate progress to next level
-    current_level_xp = sum([i * 100 for i in range(1, user.level)])
-    next_level_xp = current_level_xp + (user.level * 100)
-    xp_progress = ((user.xp - current_level_xp) / (user.level * 100)) * 100 if user.level > 0 else 0
-    
-    return jsonify({
+    return cache_response(user, etag, jsonify({
         'user': {
             'id': user.id,
             'username': user.username,
@@ -698,11 +2334,118 @@ def get_user_profile():
             'timezone': user.timezone
         },
         'badges': badges,
-        'progress': {
-            'current_level_xp': current_level_xp,
-            'next_level_xp': next_level_xp,
-            'xp_progress': xp_progress
+        'progress': level_progress(user)
+    }))
+
+# Challenge Routes
+@app.route('/api/challenges/<int:challenge_id>/join', methods=['POST'])
+def join_challenge(challenge_id):
+    """Join a challenge; its progress is tracked on a new habit built from the challenge template."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
+    
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    challenge = Challenge.query.get_or_404(challenge_id)
+    if not can_view_challenge(user.id, challenge):
+        return jsonify({'error': 'Unauthorized'}), 403
+    if challenge.end_date < user_today(user):
+        return jsonify({'error': 'Challenge has ended'}), 400
+    if ChallengeParticipant.query.filter_by(challenge_id=challenge.id, user_id=user.id).first():
+        return jsonify({'error': 'Already joined'}), 409
+    
+    try:
+        template = json.loads(challenge.habit_template or '{}')
+    except ValueError:
+        template = {}
+    
+    user = User.query.get(user.id)  # The new habit changes the habit list
+    bump_data_version(user)
+    habit = Habit(
+        user_id=user.id,
+        name=template.get('name', challenge.name),
+        description=template.get('description', challenge.description or ''),
+        frequency=template.get('frequency', 'daily'),
+        repeat_days=json.dumps(template.get('repeat_days', [])),
+        start_date=challenge.start_date,
+        end_date=challenge.end_date,
+        habit_type=template.get('habit_type', 'yes_no'),
+        target_value=template.get('target_value', 1.0),
+        unit=template.get('unit'),
+        icon=template.get('icon', 'star')
+    )
+    db.session.add(habit)
+    db.session.flush()
+    participant = ChallengeParticipant(challenge_id=challenge.id, user_id=user.id, habit_id=habit.id)
+    db.session.add(participant)
+    challenge.participant_count = Challenge.participant_count + 1
+    db.session.commit()
+    
+    return jsonify({'message': 'Joined challenge', 'habit_id': habit.id}), 201
+
+@app.route('/api/challenges/<int:challenge_id>/leaderboard', methods=['GET'])
+def get_challenge_leaderboard(challenge_id):
+    """Top participants by days completed, then current streak, and the caller's own rank."""
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'error': 'No token provided'}), 401
+    
+    user = get_user_from_token(token)
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    challenge = Challenge.query.get_or_404(challenge_id)
+    if not can_view_challenge(user.id, challenge):
+        return jsonify({'error': 'Unauthorized'}), 403
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    
+    read_from_replica()
+    
+    # Walks ix_challenge_participant_rank backwards and stops after `limit` rows
+    rows = db.session.query(
+        ChallengeParticipant.user_id, User.username, ChallengeParticipant.days_completed, ChallengeParticipant.current_streak
+    ).join(User, User.id == ChallengeParticipant.user_id).filter(
+        ChallengeParticipant.challenge_id == challenge.id
+    ).order_by(
+        ChallengeParticipant.days_completed.desc(), ChallengeParticipant.current_streak.desc()
+    ).limit(limit).all()
+    
+    # Participants with the same score share a rank
+    top = []
+    for position, (user_id, username, days_completed, current_streak) in enumerate(rows, 1):
+        tied = top and (top[-1]['days_completed'], top[-1]['current_streak']) == (days_completed, current_streak)
+        top.append({
+            'rank': top[-1]['rank'] if tied else position,
+            'user_id': user_id,
+            'username': username,
+            'days_completed': days_completed,
+            'current_streak': current_streak
+        })
+    
+    me = None
+    mine = db.session.query(ChallengeParticipant.days_completed, ChallengeParticipant.current_streak).filter_by(
+        challenge_id=challenge.id, user_id=user.id
+    ).first()
+    if mine:
+        me = {
+            'rank': challenge_rank(challenge.id, *mine),
+            'days_completed': mine.days_completed,
+            'current_streak': mine.current_streak
         }
+    
+    return jsonify({
+        'challenge': {
+            'id': challenge.id,
+            'name': challenge.name,
+            'start_date': challenge.start_date.isoformat(),
+            'end_date': challenge.end_date.isoformat()
+        },
+        'participants': challenge.participant_count,
+        'top': top,
+        'me': me
     })
 
 # Categories Routes
@@ -729,6 +2472,25 @@ def get_categories():
         'is_custom': cat.user_id == user.id
     } for cat in categories])
 
+@app.route('/api/metrics/cache', methods=['GET'])
+def get_cache_metrics():
+    return jsonify({
+        'user_cache': user_cache.stats(),
+        'response_cache': response_cache.stats() if response_cache is not None else None
+    })
+
+@app.route('/api/metrics/events', methods=['GET'])
+def get_event_metrics():
+    return jsonify(event_broker.stats())
+
+@app.route('/api/metrics/storage', methods=['GET'])
+def get_storage_metrics():
+    replica = app.extensions.get('read_replica')
+    return jsonify({
+        'profile': app.config['STORAGE_PROFILE'],
+        'read_replica': replica.stats() if replica else None
+    })
+
 # AI Insights Route
 @app.route('/api/ai/insights', methods=['GET'])
 def get_ai_insights():
@@ -740,21 +2502,12 @@ def get_ai_insights():
     if not user:
         return jsonify({'error': 'Invalid token'}), 401
     
-    # Get existing unread insights
-    insights = AIInsight.query.filter_by(user_id=user.id, is_read=False).order_by(AIInsight.created_at.desc()).limit(5).all()
-    
-    # Generate new insights if needed (simplified for now)
-    if len(insights) < 3:
-        new_insight = AIInsight(
-            user_id=user.id,
-            insight_type='motivation',
-            title='Keep up the great work!',
-            content=f'You\'re at level {user.level} with {user.xp} XP. You\'re making excellent progress!',
-            confidence_score=0.9
-        )
-        db.session.add(new_insight)
-        db.session.commit()
-        insights.append(new_insight)
+    read_from_replica()
+    
+    # Written by generate-insights; this only reads them, off ix_ai_insight_user_unread
+    insights = AIInsight.query.filter_by(user_id=user.id, is_read=False).order_by(
+        AIInsight.created_at.desc(), AIInsight.confidence_score.desc()
+    ).limit(5).all()
     
     return jsonify([{
         'id': insight.id,
@@ -765,6 +2518,204 @@ def get_ai_insights():
         'created_at': insight.created_at.isoformat()
     } for insight in insights])
 
+# Database setup
+def upgrade_database():
+    """Bring databases created by older versions up to the current schema."""
+    inspector = db.inspect(db.engine)
+    columns = {column['name'] for column in inspector.get_columns('habit_log')}
+    user_columns = {column['name'] for column in inspector.get_columns('user')}
+    participant_columns = {column['name'] for column in inspector.get_columns('challenge_participant')}
+    challenge_columns = {column['name'] for column in inspector.get_columns('challenge')}
+    streak_columns = {column['name'] for column in inspector.get_columns('habit_streak')}
+    streak_rules_added = False
+    log_days_added = False
+    
+    with db.engine.begin() as conn:
+        if 'day' not in columns:
+            conn.execute(db.text('ALTER TABLE habit_log ADD COLUMN day DATE'))
+            conn.execute(db.text('UPDATE habit_log SET day = date(completed_at)'))  # UTC; moved to local days below
+            log_days_added = True
+        if 'data_version' not in user_columns:
+            conn.execute(db.text('ALTER TABLE "user" ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0'))
+        if 'habit_id' not in participant_columns:
+            conn.execute(db.text('ALTER TABLE challenge_participant ADD COLUMN habit_id INTEGER REFERENCES habit (id)'))
+            conn.execute(db.text('ALTER TABLE challenge_participant ADD COLUMN last_completed_day DATE'))
+            conn.execute(db.text('UPDATE challenge_participant SET days_completed = 0 WHERE days_completed IS NULL'))
+            conn.execute(db.text('UPDATE challenge_participant SET current_streak = 0 WHERE current_streak IS NULL'))
+        if 'last_active_day' not in streak_columns:
+            conn.execute(db.text('ALTER TABLE habit_streak ADD COLUMN last_active_day DATE'))
+            conn.execute(db.text('UPDATE habit_streak SET last_active_day = last_completed_day'))
+            streak_rules_added = True
+        if 'participant_count' not in challenge_columns:
+            conn.execute(db.text('ALTER TABLE challenge ADD COLUMN participant_count INTEGER NOT NULL DEFAULT 0'))
+            conn.execute(db.text(
+                'UPDATE challenge SET participant_count = '
+                '(SELECT count(*) FROM challenge_participant WHERE challenge_participant.challenge_id = challenge.id)'
+            ))
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    
+    if log_days_added:
+        rebucket_log_days()
+        db.session.commit()
+    
+    # Older records ignored allow_skips and max_misses_per_week
+    if streak_rules_added:
+        rebuild_habit_streaks([habit_id for (habit_id,) in db.session.query(Habit.id).join(
+            HabitStreak, HabitStreak.habit_id == Habit.id
+        ).filter(
+            db.or_(Habit.allow_skips == True, Habit.max_misses_per_week > 0)
+        )])
+        db.session.commit()
+
+def init_db():
+    db.create_all()
+    upgrade_database()
+    
+    # Backfill streak records for databases created before they existed
+    if HabitStreak.query.count() == 0 and HabitLog.query.count() > 0:
+        rebuild_habit_streaks()
+        db.session.commit()
+    
+    if DailyRollup.query.count() == 0 and HabitLog.query.count() > 0:
+        rebuild_daily_rollups()
+        db.session.commit()
+    
+    if UserStats.query.count() == 0 and HabitLog.query.count() > 0:
+        rebuild_user_stats()
+        db.session.commit()
+    
+    if app.config['BITSET_HISTORY'] and HabitYearBits.query.count() == 0 and HabitLog.query.count() > 0:
+        rebuild_year_bits()
+        db.session.commit()
+    
+    # Create default badges if they don't exist
+    if Badge.query.count() == 0:
+        default_badges = [
+            ('First Step', 'Complete your first habit', 'star', 'completion', 1, 10, 5),
+            ('Week Warrior', '7-day streak', 'fire', 'streak', 7, 50, 25),
+            ('Habit Master', '30-day streak', 'crown', 'streak', 30, 200, 100),
+            ('Consistency King', '100 habit completions', 'king', 'completion', 100, 150, 75),
+            ('Early Bird', 'Complete habits before 7 AM for 5 days', 'sun', 'special', 5, 75, 40)
+        ]
+        
+        for name, desc, icon, cond_type, cond_val, xp_reward, coin_reward in default_badges:
+            badge = Badge(
+                name=name,
+                description=desc,
+                icon=icon,
+                condition_type=cond_type,
+                condition_value=cond_val,
+                xp_reward=xp_reward,
+                coin_reward=coin_reward
+            )
+            db.session.add(badge)
+        
+        db.session.commit()
+
+# CLI commands
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and migrate existing ones in place."""
+    init_db()
+    print('Database is up to date')
+
+@app.cli.command('rebuild-streaks')
+def rebuild_streaks_command():
+    """Recompute every habit's streak record from its logs."""
+    count = rebuild_habit_streaks()
+    db.session.commit()
+    print(f'Rebuilt streaks for {count} habits')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Regenerate the per-day rollup table from the habit logs."""
+    count = rebuild_daily_rollups()
+    db.session.commit()
+    print(f'Rebuilt {count} daily rollup rows')
+
+@app.cli.command('rebuild-user-stats')
+def rebuild_user_stats_command():
+    """Recompute every user's badge counters from their history."""
+    count = rebuild_user_stats()
+    db.session.commit()
+    print(f'Rebuilt badge counters for {count} users')
+
+@app.cli.command('rebuild-challenges')
+def rebuild_challenges_command():
+    """Recount every challenge participant's progress from their habit logs."""
+    count = rebuild_challenge_counters()
+    db.session.commit()
+    print(f'Rebuilt progress for {count} challenge participants')
+
+@app.cli.command('generate-insights')
+def generate_insights_command():
+    """Recompute every user's pattern insights; run it daily, e.g. from cron."""
+    summary = generate_insights()
+    print(f"Generated {summary['insights']} insights for {summary['users']} users in {summary['seconds']}s")
+
+@app.cli.command('rebucket-log-days')
+@click.option('--before', required=True, help='UTC date the database was upgraded to per-day logs (YYYY-MM-DD); later logs are left alone.')
+def rebucket_log_days_command(before):
+    """Move logs whose day was backfilled as the UTC date to the local day in their user's timezone."""
+    try:
+        before = datetime.strptime(before, '%Y-%m-%d')
+    except ValueError:
+        raise click.BadParameter('expected YYYY-MM-DD', param_hint='--before')
+    count = rebucket_log_days(before)
+    db.session.commit()
+    print(f'Moved {count} logs to their local day')
+
+@app.cli.command('rebuild-bitsets')
+def rebuild_bitsets_command():
+    """Regenerate every habit's year bitmaps from its logs."""
+    count = rebuild_year_bits()
+    db.session.commit()
+    print(f'Rebuilt {count} habit-year bitmaps')
+
+@app.cli.command('import-history')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+def import_history_command(username, path, import_format):
+    """Bulk-import a CSV or NDJSON history file for USERNAME."""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'No user named {username}')
+    
+    def print_progress(rows, imported, seconds):
+        print(f'{rows} rows read, {imported} imported ({rows / seconds:.0f} rows/s)')
+    
+    with open(path, encoding='utf-8', newline='') as stream:
+        records = parse_import_records(stream, import_format or ('csv' if path.endswith('.csv') else 'ndjson'))
+        summary = import_history(user.id, records, print_progress)
+    
+    print(f"Imported {summary['imported']} of {summary['rows']} rows in {summary['seconds']}s "
+          f"({summary['rows_per_second']} rows/s): {summary['duplicates']} duplicates, "
+          f"{summary['rejected']} rejected, {summary['habits_created']} habits created")
+    for error in summary['errors']:
+        print(' ', error)
+    if summary['aborted']:
+        raise click.ClickException(f"Stopped at unreadable {summary['aborted']}")
+
+@app.cli.command('run-reminders')
+@click.option('--sink', 'sink_path', type=click.Path(dir_okay=False), help='NDJSON file to append notifications to; defaults to instance/reminders.ndjson.')
+@click.option('--reload-every', default=60, show_default=True, help='Seconds between reloads of the reminder table.')
+def run_reminders_command(sink_path, reload_every):
+    """Fire reminders as they come due until interrupted."""
+    os.makedirs(app.instance_path, exist_ok=True)
+    sink = FileSink(sink_path or os.path.join(app.instance_path, 'reminders.ndjson'))
+    scheduler = ReminderScheduler(sink, habits_done_on)
+    scheduler.load(load_scheduled_reminders(), datetime.now(timezone.utc))
+    print(f'{len(scheduler)} reminders scheduled, notifications go to {sink.path}')
+    try:
+        scheduler.run(reload=load_scheduled_reminders, reload_every=reload_every)
+    except KeyboardInterrupt:
+        pass
+    print('Stopped:', ', '.join(f'{value} {name}' for name, value in scheduler.stats().items()))
+
 # Serve frontend
 @app.route('/')
 def index():
@@ -772,30 +2723,6 @@ def index():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
-        
-        # Create default badges if they don't exist
-        if Badge.query.count() == 0:
-            default_badges = [
-                ('First Step', 'Complete your first habit', 'star', 'completion', 1, 10, 5),
-                ('Week Warrior', '7-day streak', 'fire', 'streak', 7, 50, 25),
-                ('Habit Master', '30-day streak', 'crown', 'streak', 30, 200, 100),
-                ('Consistency King', '100 habit completions', 'king', 'completion', 100, 150, 75),
-                ('Early Bird', 'Complete habits before 7 AM for 5 days', 'sun', 'special', 5, 75, 40)
-            ]
-            
-            for name, desc, icon, cond_type, cond_val, xp_reward, coin_reward in default_badges:
-                badge = Badge(
-                    name=name,
-                    description=desc,
-                    icon=icon,
-                    condition_type=cond_type,
-                    condition_value=cond_val,
-                    xp_reward=xp_reward,
-                    coin_reward=coin_reward
-                )
-                db.session.add(badge)
-            
-            db.session.commit()
+        init_db()
     
     app.run(debug=True, port=5000)
\ No newline at end of file
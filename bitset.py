@@ -0,0 +1,31 @@
+import calendar
+
+# One bit per day of the year, bit n = day n + 1, stored little-endian in 46 bytes (368 bits)
+YEAR_BYTES = 46
+
+def to_bytes(bits):
+    return bits.to_bytes(YEAR_BYTES, 'little')
+
+def from_bytes(data):
+    return int.from_bytes(data or b'', 'little')
+
+def day_index(day):
+    return day.timetuple().tm_yday - 1
+
+def with_day(bits, day, on):
+    """bits with day's bit set (on) or cleared."""
+    mask = 1 << day_index(day)
+    return bits | mask if on else bits & ~mask
+
+def month_masks(year):
+    masks = []
+    first = 0
+    for month in range(1, 13):
+        days = calendar.monthrange(year, month)[1]
+        masks.append(((1 << days) - 1) << first)
+        first += days
+    return masks
+
+def monthly_counts(bits, year):
+    """Days set in each month, by popcount over that month's mask."""
+    return [(bits & mask).bit_count() for mask in month_masks(year)]
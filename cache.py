@@ -0,0 +1,213 @@
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with an optional TTL and per-tag invalidation.
+    
+    Entries can carry a tag (for example a user id) so everything derived from
+    that tag can be dropped at once with invalidate_tag().
+    """
+    
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, tag)
+        self._tags = {}  # tag -> set of keys
+        self._tag_versions = {}  # tag -> number of invalidations so far
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def tag_version(self, tag):
+        """Read before computing a value; pass to set() so a racing invalidation wins."""
+        with self._lock:
+            return self._tag_versions.get(tag, 0)
+    
+    def set(self, key, value, tag=None, version=None):
+        with self._lock:
+            if version is not None and version != self._tag_versions.get(tag, 0):
+                return
+            
+            if key in self._entries:
+                self._remove(key)
+            
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = (value, expires_at, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+    
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+            for key in self._tags.pop(tag, ()):
+                del self._entries[key]
+                self.invalidations += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+    
+    def _remove(self, key):
+        _, _, tag = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+class SQLiteCache:
+    """Cache kept in a SQLite file, so every process on the host shares it.
+    
+    Offers the same get/set/delete/invalidate_tag/clear/stats calls as LRUCache
+    (without the tag-version race guard). Eviction is oldest-written first, so a
+    hit costs a read and never a write.
+    """
+    
+    EVICT_EVERY = 100  # sets between size checks
+    
+    def __init__(self, path, maxsize=10000, ttl=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sets = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, tag TEXT, expires_at REAL, written_at REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_tag ON cache (tag)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_written_at ON cache (written_at)')
+    
+    def get(self, key, default=None):
+        row = self._connection().execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return default
+        
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            self._count('expirations')
+            self._count('misses')
+            return default
+        
+        self._count('hits')
+        return value
+    
+    def set(self, key, value, tag=None):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                         (key, value, None if tag is None else str(tag), expires_at, now))
+        
+        with self._lock:
+            self._sets += 1
+            check_size = self._sets % self.EVICT_EVERY == 0
+        if check_size:
+            self._evict()
+    
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+    
+    def invalidate_tag(self, tag):
+        with self._connection() as conn:
+            removed = conn.execute('DELETE FROM cache WHERE tag = ?', (str(tag),)).rowcount
+        self._count('invalidations', removed)
+    
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache')
+    
+    def stats(self):
+        size = self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': size,
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+    
+    def _evict(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+            excess = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.maxsize
+            if excess > 0:
+                conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY written_at LIMIT ?)', (excess,))
+                self._count('evictions', excess)
+    
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+    
+    def _connection(self):
+        # One connection per thread; losing the cache in a crash is fine, so skip fsync
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn = conn
+        return conn
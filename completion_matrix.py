@@ -0,0 +1,163 @@
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # Optional: only ANALYTICS_BACKEND=numpy needs it
+    np = None
+
+HAVE_NUMPY = np is not None
+
+# Cell status, with the calendar's precedence when a day has several kinds of log
+NONE, COMPLETED, SKIPPED, MISSED = 0, 1, 2, 3
+
+# DailyRollup columns, in the order from_rollups() expects them after habit_id and day
+ROLLUP_COLUMNS = ['completed', 'skipped', 'missed', 'total_value', 'total_duration', 'mood_total', 'mood_count']
+
+class CompletionMatrix:
+    """One user's daily rollups as habits x days arrays, for whole-history analytics.
+    
+    Every ROLLUP_COLUMNS name is an attribute holding a (habits, days) array,
+    plus `present` marking the cells that had a rollup row at all. Rows follow
+    habit_ids, columns run from start to end inclusive.
+    """
+    
+    def __init__(self, habit_ids, start, end):
+        if np is None:
+            raise RuntimeError('CompletionMatrix needs numpy (pip install numpy)')
+        self.habit_ids = list(habit_ids)
+        self.row_of = {habit_id: row for row, habit_id in enumerate(self.habit_ids)}
+        self.start = start
+        self.end = end
+        
+        shape = (len(self.habit_ids), max((end - start).days + 1, 0))
+        for name in ROLLUP_COLUMNS:
+            setattr(self, name, np.zeros(shape, np.float64 if name == 'total_value' else np.int32))
+        self.present = np.zeros(shape, bool)
+    
+    @classmethod
+    def from_rollups(cls, habit_ids, rows, start=None, end=None):
+        """Build from (habit_id, day, *ROLLUP_COLUMNS) rows; day may be a date or an ISO string.
+        
+        start and end default to the first and last day in rows. Rows for other
+        habits or outside the range are ignored.
+        """
+        rows = list(rows)
+        if not rows:
+            start = start or end or date.today()
+            return cls(habit_ids, start, end or start)
+        
+        habit_column, day_column, *value_columns = zip(*rows)
+        days = np.array(day_column, dtype='datetime64[D]')
+        start = start or days.min().astype(object)
+        end = end or days.max().astype(object)
+        matrix = cls(habit_ids, start, end)
+        
+        rows_index = np.fromiter((matrix.row_of.get(habit_id, -1) for habit_id in habit_column), np.intp, len(rows))
+        columns = (days - np.datetime64(start, 'D')).astype(np.intp)
+        keep = (rows_index >= 0) & (columns >= 0) & (columns < matrix.present.shape[1])
+        rows_index, columns = rows_index[keep], columns[keep]
+        
+        for name, values in zip(ROLLUP_COLUMNS, value_columns):
+            # NULL counters read as zero, like the SQL paths' "or 0"
+            values = np.nan_to_num(np.array(values, dtype=np.float64))[keep]
+            getattr(matrix, name)[rows_index, columns] = values
+        matrix.present[rows_index, columns] = True
+        return matrix
+    
+    def columns(self, first, last):
+        """Slice of the day columns from first to last inclusive, clipped to the matrix."""
+        width = self.present.shape[1]
+        lo = min(max((first - self.start).days, 0), width)
+        hi = min(max((last - self.start).days + 1, 0), width)
+        return slice(lo, max(lo, hi))
+    
+    def status(self):
+        return np.select(
+            [self.completed > 0, self.skipped > 0, self.missed > 0], [COMPLETED, SKIPPED, MISSED], NONE
+        ).astype(np.int8)
+    
+    def daily_completed(self):
+        return self.completed.sum(axis=0)
+    
+    def heatmap(self, first, last):
+        """Per-day (completed, skipped, missed) totals between first and last, as three arrays."""
+        window = self.columns(first, last)
+        return tuple(counts[:, window].sum(axis=0) for counts in (self.completed, self.skipped, self.missed))
+    
+    def dashboard_stats(self, today):
+        """The same (totals, per_habit, best_day) get_dashboard_stats computes from the rollups."""
+        month = self.columns(today - timedelta(days=30), today)
+        week_ago = today - timedelta(days=7)
+        week = self.columns(week_ago, today)
+        daily = self.daily_completed()
+        
+        per_habit = {}
+        month_completed = self.completed[:, month].sum(axis=1).tolist()
+        month_value = self.total_value[:, month].sum(axis=1).tolist()
+        for habit_id, seen, completed, value in zip(self.habit_ids, self.present[:, month].any(axis=1).tolist(), month_completed, month_value):
+            if seen:
+                per_habit[habit_id] = (completed, value)
+        
+        week_counts = [0] * 8
+        for column, count in zip(range(week.start, week.stop), daily[week].tolist()):
+            week_counts[(self.start - week_ago).days + column] = count
+        totals = {'today': week_counts[-1], 'week': sum(week_counts), 'month': int(sum(month_completed))}
+        
+        # Best day of week over the last 7 days (today and a week ago share a weekday)
+        weekday_completion = {}
+        for offset, count in enumerate(week_counts):
+            if count:
+                day_name = (week_ago + timedelta(days=offset)).strftime('%A')
+                weekday_completion[day_name] = weekday_completion.get(day_name, 0) + count
+        best_day = max(weekday_completion.items(), key=lambda x: x[1])[0] if weekday_completion else None
+        
+        return totals, per_habit, best_day
+    
+    def calendar(self, habit_names, first=None, last=None, notes=None):
+        """The summary calendar get_calendar_data builds: ISO day -> counts and the habits logged.
+        
+        notes maps (habit_id, day) to the log's notes, which the matrix doesn't hold.
+        """
+        notes = notes or {}
+        window = self.columns(first or self.start, last or self.end)
+        status = self.status()[:, window]
+        present = self.present[:, window]
+        
+        completed, skipped, missed = self.heatmap(first or self.start, last or self.end)
+        completed, skipped, missed = completed.tolist(), skipped.tolist(), missed.tolist()
+        
+        calendar_data = {}
+        day_columns = np.flatnonzero(present.any(axis=0)).tolist()
+        for column in day_columns:
+            calendar_data[(self.start + timedelta(days=window.start + column)).isoformat()] = {
+                'completed': completed[column],
+                'skipped': skipped[column],
+                'missed': missed[column],
+                'habits': []
+            }
+        
+        # Logged cells in day, then habit order
+        columns, rows = np.nonzero(status.T)
+        cells = (rows, window.start + columns)
+        values = self.total_value[cells].tolist()
+        durations = self.total_duration[cells].tolist()
+        mood_totals = self.mood_total[cells].tolist()
+        mood_counts = self.mood_count[cells].tolist()
+        codes = status.T[columns, rows].tolist()
+        names = {COMPLETED: 'completed', SKIPPED: 'skipped', MISSED: 'missed'}
+        for column, row, code, value, duration, mood_total, mood_count in zip(
+            columns.tolist(), rows.tolist(), codes, values, durations, mood_totals, mood_counts
+        ):
+            habit_id = self.habit_ids[row]
+            day = self.start + timedelta(days=window.start + column)
+            calendar_data[day.isoformat()]['habits'].append({
+                'habit_id': habit_id,
+                'habit_name': habit_names[habit_id],
+                'status': names[code],
+                'value': value or None,
+                'notes': notes.get((habit_id, day)),
+                'duration_minutes': duration or None,
+                'mood': mood_total / mood_count if mood_count else None
+            })
+        
+        return calendar_data
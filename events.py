@@ -0,0 +1,77 @@
+import itertools
+import queue
+import threading
+
+class EventBroker:
+    """Fan out per-user events to the event streams open in this process.
+    
+    Each stream gets a bounded queue. A stream that falls a whole queue behind
+    is emptied and sent a single 'resync' event, telling the client to refetch
+    instead of replaying everything it missed.
+    """
+    
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}  # user id -> set of queues
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0
+    
+    def subscribe(self, user_id):
+        subscription = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+    
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+    
+    def publish(self, user_id, event_type, data):
+        """Queue an event for every open stream of the user. Returns how many got it."""
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+            event = (next(self._ids), event_type, data)
+            self.published += 1
+        
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                self._resync(subscription)
+        
+        with self._lock:
+            self.delivered += len(subscriptions)
+        return len(subscriptions)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._subscribers),
+                'streams': sum(len(subscriptions) for subscriptions in self._subscribers.values()),
+                'published': self.published,
+                'delivered': self.delivered,
+                'resyncs': self.resyncs
+            }
+    
+    def _resync(self, subscription):
+        while True:
+            try:
+                while True:
+                    subscription.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscription.put_nowait((next(self._ids), 'resync', {}))
+                break
+            except queue.Full:
+                continue  # Refilled by a concurrent publish before the resync got in
+        with self._lock:
+            self.resyncs += 1
@@ -0,0 +1,121 @@
+from datetime import timedelta
+import math
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Thresholds below which a pattern is too weak or too thinly sampled to report
+MIN_WEEKS = 4
+MIN_MOOD_DAYS = 10
+MIN_CORRELATION = 0.3
+DROP_OFF_RATIO = 0.5  # recent rate at most half the earlier one
+MIN_EARLIER_RATE = 0.4  # completions per day before the drop
+
+def pearson(xs, ys):
+    """Correlation coefficient of two equal-length sequences, or None when either is constant."""
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    var_y = sum((y - mean_y) ** 2 for y in ys)
+    if not var_x or not var_y:
+        return None
+    return cov / math.sqrt(var_x * var_y)
+
+def best_weekday(completed_by_day, start, end):
+    """Weekday with the most completions per occurrence between start and end (inclusive).
+    
+    Returns (weekday index, its average, the average over all days, confidence) or None.
+    """
+    days = (end - start).days + 1
+    if days < MIN_WEEKS * 7:
+        return None
+    
+    totals = [0] * 7
+    occurrences = [0] * 7
+    for offset in range(days):
+        occurrences[(start + timedelta(days=offset)).weekday()] += 1
+    for day, completed in completed_by_day.items():
+        if start <= day <= end:
+            totals[day.weekday()] += completed
+    
+    averages = [total / count for total, count in zip(totals, occurrences)]
+    overall = sum(totals) / days
+    best = max(range(7), key=averages.__getitem__)
+    if not overall or averages[best] < overall * 1.2:
+        return None
+    
+    # Stronger lift over more weeks is more trustworthy
+    lift = averages[best] / overall - 1
+    confidence = min(0.95, lift * min(1.0, days / 84))
+    return best, averages[best], overall, round(confidence, 2)
+
+def mood_correlation(mood_days):
+    """Correlation of daily completions with average mood, over (completed, mood) pairs.
+    
+    Returns (coefficient, number of days) or None.
+    """
+    if len(mood_days) < MIN_MOOD_DAYS:
+        return None
+    r = pearson([completed for completed, _ in mood_days], [mood for _, mood in mood_days])
+    if r is None or abs(r) < MIN_CORRELATION:
+        return None
+    return r, len(mood_days)
+
+def drop_off(recent, earlier, recent_days, earlier_days):
+    """Whether a habit's completion rate fell sharply; returns (earlier rate, recent rate) or None."""
+    earlier_rate = earlier / earlier_days
+    recent_rate = recent / recent_days
+    if earlier_rate < MIN_EARLIER_RATE or recent_rate > earlier_rate * DROP_OFF_RATIO:
+        return None
+    return earlier_rate, recent_rate
+
+def build_insights(daily, habits, start, end, recent_days, earlier_days):
+    """Insights for one user.
+    
+    daily maps day -> (completed, mood average or None) over start..end; habits
+    is a list of (name, completions in the last recent_days, completions in the
+    earlier_days before that). Returns dicts ready to insert as AIInsight rows.
+    """
+    insights = []
+    
+    weekday = best_weekday({day: completed for day, (completed, _) in daily.items()}, start, end)
+    if weekday:
+        index, average, overall, confidence = weekday
+        insights.append({
+            'insight_type': 'pattern',
+            'title': f'{WEEKDAYS[index]}s are your strongest day',
+            'content': f'You complete {average:.1f} habits on an average {WEEKDAYS[index]}, '
+                       f'against {overall:.1f} across the week. Schedule harder habits then.',
+            'confidence_score': confidence
+        })
+    
+    correlation = mood_correlation([(completed, mood) for completed, mood in daily.values() if mood is not None])
+    if correlation:
+        r, n = correlation
+        if r > 0:
+            title = 'Busier days, better moods'
+            content = f'Over {n} days with a mood logged, you felt better on days you completed more habits.'
+        else:
+            title = 'Heavy days weigh on your mood'
+            content = f'Over {n} days with a mood logged, your mood dipped on days you completed more habits. Consider lighter days.'
+        insights.append({
+            'insight_type': 'pattern',
+            'title': title,
+            'content': content,
+            'confidence_score': round(min(0.95, abs(r) * min(1.0, n / 30)), 2)
+        })
+    
+    for name, recent, earlier in habits:
+        rates = drop_off(recent, earlier, recent_days, earlier_days)
+        if rates:
+            earlier_rate, recent_rate = rates
+            insights.append({
+                'insight_type': 'suggestion',
+                'title': f'{name} has slipped',
+                'content': f'You completed {name} on {earlier_rate:.0%} of days before, and {recent_rate:.0%} '
+                           f'in the last {recent_days} days. A smaller target could get it going again.',
+                'confidence_score': round(min(0.95, 1 - recent_rate / earlier_rate), 2)
+            })
+    
+    return insights
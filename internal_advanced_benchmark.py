@@ -0,0 +1,260 @@
+import os, tempfile, time
+
+# Benchmark against a scratch database so habits_advanced.db is left alone
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_advanced.db'))
+
+from app_advanced import app, db, init_db, User, Habit, HabitLog, rebuild_habit_streaks, rebuild_daily_rollups, user_today
+from app_advanced import import_history, parse_import_records, response_cache, Reminder, load_scheduled_reminders, habits_done_on, get_zone
+from app_advanced import Group, Challenge, ChallengeParticipant, generate_insights
+from app_advanced import HabitYearBits, rebuild_year_bits, advance_streak, query_habit_streaks
+from scheduler import FileSink, ReminderScheduler
+from sqlalchemy import event, insert
+from datetime import datetime, time as day_time, timedelta
+import tracemalloc, uuid
+
+HABITS = 100
+DAYS = 730
+RUNS = 20
+REMINDERS = 100000
+PARTICIPANTS = 100000
+
+def register(client):
+    uname = f"bench_{uuid.uuid4().hex[:8]}"
+    r = client.post('/api/auth/register', json={'username': uname, 'email': f'{uname}@example.com', 'password': 'password123'})
+    return User.query.filter_by(username=uname).one(), {'Authorization': r.get_json()['token']}
+
+def seed_history(user, habits=HABITS, days=DAYS):
+    # Every habit completed most days, with the odd skip, going back `days` days
+    habit_rows = [{'user_id': user.id, 'name': f'Bench Habit {i}', 'frequency': 'daily', 'habit_type': 'measurable', 'target_value': 1.0} for i in range(habits)]
+    db.session.execute(insert(Habit), habit_rows)
+    habit_ids = [habit_id for (habit_id,) in db.session.query(Habit.id).filter_by(user_id=user.id)]
+
+    today = user_today(user)
+    rows = []
+    for habit_id in habit_ids:
+        for offset in range(days):
+            if (habit_id + offset) % 11 == 0:
+                continue
+            day = today - timedelta(days=offset)
+            status = 'skipped' if (habit_id + offset) % 7 == 0 else 'completed'
+            rows.append({'habit_id': habit_id, 'status': status, 'value': 1.0, 'day': day, 'completed_at': datetime.combine(day, day_time(8))})
+    db.session.execute(insert(HabitLog), rows)
+    rebuild_habit_streaks(habit_ids)
+    rebuild_daily_rollups([user.id])
+    db.session.commit()
+    return habit_ids, len(rows)
+
+def time_endpoint(client, url, headers, runs=RUNS, expect=200, cold=False):
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        start = time.perf_counter()
+        for _ in range(runs):
+            if cold and response_cache is not None:
+                response_cache.clear()
+            r = client.get(url, headers=headers)
+            assert r.status_code == expect
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    return elapsed / runs * 1000, len(statements) // runs
+
+with app.app_context():
+    client = app.test_client()
+    print("Running app_advanced.py benchmarks on", app.config['SQLALCHEMY_DATABASE_URI'])
+    init_db()
+
+    user, headers = register(client)
+    habit_ids, log_count = seed_history(user)
+    print(f'Seeded {len(habit_ids)} habits with {log_count} logs over {DAYS} days')
+    history_user, history_headers, history_habit_ids = user, headers, habit_ids
+
+    # 1. Dashboard for a heavy user (target: under 20 ms), computed and then from the response cache
+    ms, queries = time_endpoint(client, '/api/analytics/dashboard', headers, cold=True)
+    print(f'GET /api/analytics/dashboard  {ms:7.2f} ms/request  {queries} queries')
+    ms, queries = time_endpoint(client, '/api/analytics/dashboard', headers)
+    print(f'GET /api/analytics/dashboard  {ms:7.2f} ms/request  {queries} queries  (response cache: {app.config["RESPONSE_CACHE"]})')
+
+    # 2. Habit list for the same user
+    ms, queries = time_endpoint(client, '/api/habits', headers)
+    print(f'GET /api/habits               {ms:7.2f} ms/request  {queries} queries')
+
+    # 2b. The same two reads revalidated with If-None-Match while nothing has changed
+    for url in ('/api/analytics/dashboard', '/api/habits'):
+        r = client.get(url, headers=headers)
+        ms, queries = time_endpoint(client, url, dict(headers, **{'If-None-Match': r.headers['ETag']}), expect=304)
+        print(f'GET {url:<26} {ms:7.2f} ms/request  {queries} queries  (304, {len(r.data) / 1024:.0f} KiB saved)')
+
+    # 3. Calendar for the last month
+    month_ago = (user_today(user) - timedelta(days=30)).isoformat()
+    ms, queries = time_endpoint(client, f'/api/analytics/calendar?start_date={month_ago}', headers, cold=True)
+    print(f'GET /api/analytics/calendar   {ms:7.2f} ms/request  {queries} queries  (30 days)')
+
+    # 4. Streamed per-log calendar: peak memory follows one day, not the range
+    def stream_calendar(url):
+        r = client.get(url, headers=headers, buffered=False)
+        return sum(len(chunk) for chunk in r.response)
+
+    for days in (30, 365, DAYS):
+        start_date = (user_today(user) - timedelta(days=days)).isoformat()
+        url = f'/api/analytics/calendar?mode=stream&limit=366&start_date={start_date}'
+        started = time.perf_counter()
+        size = stream_calendar(url)
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        stream_calendar(url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'GET /api/analytics/calendar?mode=stream  {days:>4} days  {elapsed * 1000:8.2f} ms  {size / 1024:6.0f} KiB streamed  {peak / 1024:5.0f} KiB peak')
+
+    # 4b. Full-history export: memory follows the chunk size, not the history
+    for export_format in ('ndjson', 'csv'):
+        started = time.perf_counter()
+        size = stream_calendar(f'/api/export?format={export_format}')
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        stream_calendar(f'/api/export?format={export_format}')
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'GET /api/export?format={export_format:<6}  {log_count / elapsed:9.0f} rows/s  {size / 1024:6.0f} KiB streamed  {peak / 1024:5.0f} KiB peak')
+
+    # 4c. Importing that history into a new account, against one ORM add per row
+    export_path = os.path.join(tempfile.mkdtemp(), 'history.ndjson')
+    with open(export_path, 'wb') as export_file:
+        for chunk in client.get('/api/export', headers=headers, buffered=False).response:
+            export_file.write(chunk)
+    import_user, _ = register(client)
+    with open(export_path, encoding='utf-8') as stream:
+        summary = import_history(import_user.id, parse_import_records(stream, 'ndjson'))
+    print(f"import_history                 {summary['rows_per_second']:9} rows/s  ({summary['imported']} logs, {summary['habits_created']} habits)")
+
+    orm_user, _ = register(client)
+    orm_habit = Habit(user_id=orm_user.id, name='ORM import', frequency='daily')
+    db.session.add(orm_habit)
+    db.session.commit()
+    started = time.perf_counter()
+    for offset in range(2000):
+        db.session.add(HabitLog(habit_id=orm_habit.id, status='completed', day=user_today(orm_user) - timedelta(days=offset)))
+        db.session.commit()
+    print(f'one HabitLog per commit        {2000 / (time.perf_counter() - started):9.0f} rows/s')
+
+    # 5. Completion throughput on a fresh user, one new log per request
+    user, headers = register(client)
+    habit_ids = [client.post('/api/habits', json={'name': f'Throughput {i}', 'frequency': 'daily'}, headers=headers).get_json()['habit_id'] for i in range(200)]
+    commits = []
+    event.listen(db.engine, 'commit', lambda conn: commits.append(1))
+    started = time.perf_counter()
+    for habit_id in habit_ids:
+        r = client.post(f'/api/habits/{habit_id}/complete', json={'status': 'completed', 'value': 1}, headers=headers)
+        assert r.status_code == 200
+    elapsed = time.perf_counter() - started
+    print(f'POST /api/habits/<id>/complete  {len(habit_ids) / elapsed:7.1f} completions/s  {len(commits) / len(habit_ids):.2f} commits each')
+
+    # 6. The same kind of completions replayed through the batch endpoint
+    user, headers = register(client)
+    habit_ids = [client.post('/api/habits', json={'name': f'Batch {i}', 'frequency': 'daily'}, headers=headers).get_json()['habit_id'] for i in range(200)]
+    today = user_today(user)
+    entries = [{'habit_id': habit_id, 'day': (today - timedelta(days=offset)).isoformat(), 'value': 1}
+               for offset in range(6, -1, -1) for habit_id in habit_ids]
+    started = time.perf_counter()
+    for start in range(0, len(entries), app.config['MAX_BATCH_ENTRIES']):
+        r = client.post('/api/habits/complete/batch', json={'entries': entries[start:start + app.config['MAX_BATCH_ENTRIES']]}, headers=headers)
+        assert r.status_code == 200, r.get_json()
+    elapsed = time.perf_counter() - started
+    print(f'POST /api/habits/complete/batch  {len(entries) / elapsed:7.1f} completions/s  ({len(entries)} entries)')
+
+    # 7. A minute's worth of reminders (target: 100k in well under 60 s of one core), half of them smart
+    user, headers = register(client)
+    habit_ids, _ = seed_history(user, days=7)
+    db.session.execute(insert(Reminder), [
+        {'habit_id': habit_ids[i % len(habit_ids)], 'time': day_time(12, 0, i % 60), 'is_smart': i % 2 == 0,
+         'days': '[1,2,3,4,5,6,7]' if i % 10 == 0 else None, 'is_active': True}
+        for i in range(REMINDERS)
+    ])
+    db.session.commit()
+    noon = datetime.combine(user_today(user), day_time(12), tzinfo=get_zone(user.timezone))
+    sink = FileSink(os.path.join(tempfile.mkdtemp(), 'reminders.ndjson'))
+    scheduler = ReminderScheduler(sink, habits_done_on)
+    started = time.process_time()
+    scheduler.load([reminder for reminder in load_scheduled_reminders() if reminder.user_id == user.id], noon - timedelta(hours=1))
+    loaded = time.process_time() - started
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    started = time.process_time()
+    for second in range(60):
+        scheduler.tick(noon + timedelta(seconds=second))
+    elapsed = time.process_time() - started
+    event.remove(db.engine, 'before_cursor_execute', count_statement)
+    handled = scheduler.fired + scheduler.suppressed
+    print(f'ReminderScheduler  load {len(scheduler)} in {loaded:.2f} s, fire {handled} in {elapsed:.2f} s CPU  '
+          f'{handled / elapsed * 60:9.0f} reminders/min  ({scheduler.suppressed} suppressed, {len(statements)} queries in {scheduler.ticks} ticks)')
+
+    # 8. Leaderboard reads for a challenge with 100k participants (target: a few ms, independent of size)
+    group = Group(name='Bench group', code=uuid.uuid4().hex[:10], created_by=user.id)
+    db.session.add(group)
+    db.session.flush()
+    challenge = Challenge(group_id=group.id, name='Bench challenge', start_date=user_today(user) - timedelta(days=60),
+                          end_date=user_today(user), participant_count=PARTICIPANTS + 1)
+    db.session.add(challenge)
+    db.session.flush()
+    prefix = uuid.uuid4().hex[:8]
+    db.session.execute(insert(User), [
+        {'username': f'lb_{prefix}_{i}', 'email': f'lb_{prefix}_{i}@example.com', 'password_hash': '-'} for i in range(PARTICIPANTS)
+    ])
+    member_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.username.like(f'lb_{prefix}_%'))]
+    db.session.execute(insert(ChallengeParticipant), [
+        {'challenge_id': challenge.id, 'user_id': user_id, 'days_completed': (user_id * 7919) % 61, 'current_streak': (user_id * 104729) % 31}
+        for user_id in member_ids
+    ] + [{'challenge_id': challenge.id, 'user_id': user.id, 'days_completed': 30, 'current_streak': 5}])
+    db.session.commit()
+    ms, queries = time_endpoint(client, f'/api/challenges/{challenge.id}/leaderboard?limit=10', headers)
+    print(f'GET /api/challenges/<id>/leaderboard  {ms:7.2f} ms/request  {queries} queries  ({len(member_ids) + 1} participants)')
+
+    # 9. Offline insight generation over every user so far (including the leaderboard's), then the read it feeds
+    summary = generate_insights()
+    print(f"generate_insights              {summary['users'] / summary['seconds']:9.0f} users/s  ({summary['users']} users, {summary['insights']} insights in {summary['seconds']} s)")
+    ms, queries = time_endpoint(client, '/api/ai/insights', headers)
+    print(f'GET /api/ai/insights          {ms:7.2f} ms/request  {queries} queries')
+
+    # 10. Year bitmaps for the heavy user: their size next to the logs, and the heatmap from them against one built from the logs
+    app.config['BITSET_HISTORY'] = True
+    bitmap_rows = rebuild_year_bits(history_habit_ids)
+    db.session.commit()
+    bitmap_bytes = db.session.query(db.func.sum(db.func.length(HabitYearBits.completed) + db.func.length(HabitYearBits.skipped))).filter(
+        HabitYearBits.habit_id.in_(history_habit_ids)
+    ).scalar()
+    print(f'HabitYearBits                  {bitmap_rows} rows, {bitmap_bytes / 1024:.0f} KiB of bitmaps for {log_count} logs')
+
+    ms, queries = time_endpoint(client, f'/api/habits/{history_habit_ids[0]}/heatmap', history_headers)
+    print(f'GET /api/habits/<id>/heatmap  {ms:7.2f} ms/request  {queries} queries, from the bitmaps')
+    app.config['BITSET_HISTORY'] = False
+    ms, queries = time_endpoint(client, f'/api/habits/{history_habit_ids[0]}/heatmap', history_headers)
+    print(f'GET /api/habits/<id>/heatmap  {ms:7.2f} ms/request  {queries} queries, from the year\'s logs')
+
+    # 11. Streak records for all the heavy user's habits: one window-function query, against folding every log in Python
+    started = time.perf_counter()
+    rebuild_habit_streaks(history_habit_ids)
+    engine_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    state = {}
+    for habit_id, day in db.session.query(HabitLog.habit_id, HabitLog.day).filter(
+        HabitLog.habit_id.in_(history_habit_ids), HabitLog.status == 'completed'
+    ).order_by(HabitLog.habit_id, HabitLog.day):
+        state[habit_id] = advance_streak(*state.get(habit_id, (0, 0, None)), day)
+    fold_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    query_habit_streaks(history_habit_ids[:1])
+    one_ms = (time.perf_counter() - started) * 1000
+    db.session.rollback()
+    print(f'rebuild streaks, {len(history_habit_ids)} habits    {engine_ms:7.2f} ms in SQL   {fold_ms:7.2f} ms folded in Python   one habit {one_ms:5.2f} ms')
+
+    print('Benchmarks completed')
@@ -1,12 +1,24 @@
-from app_advanced import app, db
-import json, uuid
+from app_advanced import app, db, init_db, User, HabitLog, user_today, get_habit_streaks, rebuild_habit_streaks, rebuild_daily_rollups
+from app_advanced import UserStats, rebuild_user_stats, Reminder, load_scheduled_reminders, habits_done_on
+from app_advanced import Group, Challenge, ChallengeParticipant, rebuild_challenge_counters, AIInsight, generate_insights
+from app_advanced import response_cache, rebuild_year_bits, stored_year_bits, habit_year_bits, get_habit_streak, query_habit_streaks
+from app_advanced import DailyRollup, rebucket_log_days
+from completion_matrix import HAVE_NUMPY
+from storage import ReadReplica
+from cache import SQLiteCache
+import app_advanced
+from scheduler import QueueSink, ReminderScheduler
+from sqlalchemy import event
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+import base64, io, json, os, queue, sqlite3, tempfile, threading, uuid
 
 with app.app_context():
     client = app.test_client()
     print("Running internal advanced API tests using Flask test_client")
 
-    # Ensure DB tables exist
-    db.create_all()
+    # Ensure DB tables exist and are migrated
+    init_db()
 
     # Create unique user
     uname = f"test_{uuid.uuid4().hex[:8]}"
@@ -71,4 +83,452 @@ with app.app_context():
     r = client.get('/api/habits', headers=headers)
     print('GET HABITS ->', r.status_code, json.dumps(r.get_json(), indent=2) if r.status_code==200 else r.get_json())
 
+    # 8. Query budget for GET /api/habits stays flat as habits grow
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def count_habit_list_queries():
+        client.get('/api/habits', headers=headers)  # warm the user cache
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            r = client.get('/api/habits', headers=headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        assert r.status_code == 200, r.get_json()
+        return len(statements), len(r.get_json())
+
+    few_queries, few_habits = count_habit_list_queries()
+    for i in range(40):
+        r = client.post('/api/habits', json=dict(habit_data, name=f'Bulk Habit {i}'), headers=headers)
+        if i % 2 == 0:
+            client.post(f"/api/habits/{r.get_json()['habit_id']}/complete", json={'status': 'completed'}, headers=headers)
+    many_queries, many_habits = count_habit_list_queries()
+    print('HABIT LIST QUERIES ->', f'{few_habits} habits: {few_queries},', f'{many_habits} habits: {many_queries}')
+    assert many_queries <= 6, many_queries
+    assert many_queries == few_queries, (few_queries, many_queries)
+
+    # 9. Incrementally maintained streaks match a rebuild from the logs
+    user_habit_ids = [h['id'] for h in client.get('/api/habits', headers=headers).get_json()]
+    user_id = User.query.filter_by(username=uname).first().id
+    today = user_today(User.query.get(user_id))
+    incremental = get_habit_streaks(user_habit_ids, today)
+    rebuild_habit_streaks(user_habit_ids)
+    db.session.commit()
+    assert get_habit_streaks(user_habit_ids, today) == incremental
+    print('STREAK REBUILD -> consistent for', len(user_habit_ids), 'habits')
+
+    # Same for the daily rollups behind the calendar and dashboard
+    calendar = client.get('/api/analytics/calendar', headers=headers).get_json()
+    rebuild_daily_rollups([user_id])
+    db.session.commit()
+    assert client.get('/api/analytics/calendar', headers=headers).get_json() == calendar
+    print('ROLLUP REBUILD -> consistent for', len(calendar), 'days')
+    assert [entry['notes'] for day in calendar.values() for entry in day['habits'] if entry['habit_id'] == habit_id] == ['done'], calendar
+
+    # Badge counters match a rebuild, and the first completion earned 'First Step'
+    stats = UserStats.query.get(user_id)
+    counters = (stats.total_completions, stats.best_streak, stats.early_bird_days)
+    rebuild_user_stats([user_id])
+    db.session.commit()
+    stats = UserStats.query.get(user_id)
+    assert (stats.total_completions, stats.best_streak, stats.early_bird_days) == counters, counters
+    badges = client.get('/api/user/profile', headers=headers).get_json()['badges']
+    assert 'First Step' in [badge['name'] for badge in badges], badges
+    print('BADGE COUNTERS ->', counters)
+
+    # Cached user snapshots are dropped as soon as XP changes
+    xp_before = client.get('/api/user/profile', headers=headers).get_json()['user']['xp']
+    client.post('/api/habits', json=dict(habit_data, name='Cache Check'), headers=headers)
+    xp_after = client.get('/api/user/profile', headers=headers).get_json()['user']['xp']
+    assert xp_after == xp_before + 5, (xp_before, xp_after)
+    print('USER CACHE ->', client.get('/api/metrics/cache').get_json()['user_cache'])
+
+    # Streamed per-log calendar pages through the same days by keyset
+    streamed, after = {}, ''
+    while after is not None:
+        r = client.get(f'/api/analytics/calendar?mode=stream&limit=1&after={after}', headers=headers)
+        page = json.loads(r.get_data(as_text=True))
+        streamed.update(page['days'])
+        after = page['next_after']
+    assert sorted(streamed) == sorted(calendar)
+    assert all(streamed[day]['completed'] == calendar[day]['completed'] for day in calendar)
+    print('STREAMED CALENDAR ->', len(streamed), 'days')
+
+    # 10. Offline replay: three days for two habits in one batch, then the same batch again
+    user_habits = client.get('/api/habits', headers=headers).get_json()
+    replay_ids = [h['id'] for h in user_habits if h['name'].startswith('Bulk Habit')][1:3]
+    replay_days = [(today - timedelta(days=offset)).isoformat() for offset in (3, 2, 1)]
+    batch = {'entries': [{'habit_id': hid, 'day': day, 'status': 'completed', 'value': 1} for hid in replay_ids for day in replay_days]}
+    xp_before = client.get('/api/user/profile', headers=headers).get_json()['user']['xp']
+    r = client.post('/api/habits/complete/batch', json=batch, headers=headers)
+    print('BATCH COMPLETE ->', r.status_code, r.get_json())
+    assert r.status_code == 200 and r.get_json()['created'] == 6, r.get_json()
+    assert all(s['longest_streak'] >= 3 for s in r.get_json()['streaks'].values())
+    xp_after = client.get('/api/user/profile', headers=headers).get_json()['user']['xp']
+    assert xp_after >= xp_before + 60, (xp_before, xp_after)
+    r = client.post('/api/habits/complete/batch', json=batch, headers=headers)
+    assert r.get_json()['updated'] == 6 and r.get_json()['newly_completed'] == 0, r.get_json()
+    assert client.get('/api/user/profile', headers=headers).get_json()['user']['xp'] == xp_after
+    replayed = get_habit_streaks(replay_ids, today)
+    rebuild_habit_streaks(replay_ids)
+    db.session.commit()
+    assert get_habit_streaks(replay_ids, today) == replayed
+
+    # Entries the importer would reject are skipped and reported, the rest still log
+    checked_day = (today - timedelta(days=5)).isoformat()
+    r = client.post('/api/habits/complete/batch', json={'entries': [
+        {'habit_id': replay_ids[0], 'day': checked_day, 'mood': 'happy'},
+        {'habit_id': replay_ids[0], 'day': checked_day, 'value': 'abc'},
+        {'habit_id': replay_ids[0], 'day': (today + timedelta(days=1)).isoformat()},
+        {'habit_id': replay_ids[0], 'day': checked_day, 'value': '2.5', 'mood': 4, 'duration_minutes': '30'}
+    ]}, headers=headers)
+    assert r.status_code == 200 and r.get_json()['created'] == 1, r.get_json()
+    assert [rejection['index'] for rejection in r.get_json()['rejected']] == [0, 1, 2], r.get_json()
+    checked_log = HabitLog.query.filter_by(habit_id=replay_ids[0], day=datetime.strptime(checked_day, '%Y-%m-%d').date()).one()
+    assert (checked_log.value, checked_log.mood, checked_log.duration_minutes) == (2.5, 4, 30)
+    r = client.post('/api/habits/complete/batch', json={'entries': [{'habit_id': replay_ids[0], 'mood': 'happy'}]}, headers=headers)
+    assert r.status_code == 400 and r.get_json()['rejected'][0]['index'] == 0, r.get_json()
+
+    # 11. Export streams every log once, in both formats, and since= narrows it
+    r = client.get('/api/export', headers=headers)
+    exported = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    log_count = HabitLog.query.filter(HabitLog.habit_id.in_(user_habit_ids)).count()
+    assert r.mimetype == 'application/x-ndjson' and len(exported) == log_count, (len(exported), log_count)
+    r = client.get('/api/export?format=csv', headers=headers)
+    csv_lines = r.get_data(as_text=True).splitlines()
+    assert csv_lines[0].startswith('log_id,habit_id,habit_name') and len(csv_lines) == log_count + 1
+    since = exported[-1]['completed_at']
+    r = client.get(f'/api/export?since={since}', headers=headers)
+    assert all(json.loads(line)['completed_at'] >= since for line in r.get_data(as_text=True).splitlines())
+    assert client.get('/api/export?since=yesterday', headers=headers).status_code == 400
+    print('EXPORT ->', len(exported), 'logs')
+
+    # 12. The export imports into a fresh account, and importing it again only finds duplicates
+    import_user = f"import_{uuid.uuid4().hex[:8]}"
+    r = client.post('/api/auth/register', json={'username': import_user, 'email': f'{import_user}@example.com', 'password': pwd})
+    import_headers = {'Authorization': r.get_json()['token']}
+    export_body = client.get('/api/export', headers=headers).get_data()
+    bad_rows = b'{"habit_name": "Bad", "day": "not-a-day"}\n' + json.dumps({'habit_name': 'Ghost', 'day': (today - timedelta(days=1)).isoformat(), 'value': 'abc'}).encode() + b'\n'
+    repeated_row = json.dumps(dict(json.loads(export_body.splitlines()[0]), notes='second copy')).encode() + b'\n'
+    r = client.post('/api/import', data=export_body + bad_rows + repeated_row, content_type='application/x-ndjson', headers=import_headers)
+    summary = r.get_json()
+    print('IMPORT ->', r.status_code, summary)
+    assert summary['imported'] == len(exported) and summary['rejected'] == 2 and summary['duplicates'] == 1, summary
+    assert not HabitLog.query.filter_by(notes='second copy').count()
+    imported_habits = client.get('/api/habits', headers=import_headers).get_json()
+    assert summary['habits_created'] == len(imported_habits) and 'Ghost' not in [h['name'] for h in imported_habits]
+    csv_body = client.get('/api/export?format=csv', headers=headers).get_data()
+    r = client.post('/api/import', data={'file': (io.BytesIO(csv_body), 'history.csv')}, headers=import_headers)
+    assert r.get_json()['duplicates'] == len(exported) and r.get_json()['imported'] == 0, r.get_json()
+    import_ids = [h['id'] for h in imported_habits]
+    imported_streaks = get_habit_streaks(import_ids, today)
+    rebuild_habit_streaks(import_ids)
+    db.session.commit()
+    assert get_habit_streaks(import_ids, today) == imported_streaks
+
+    # 13. A snapshot replica serves analytics reads until it is refreshed
+    app.extensions['read_replica'] = replica = ReadReplica(db.engine, 'snapshot', max_staleness=60)
+    try:
+        dashboard = client.get('/api/analytics/dashboard', headers=headers).get_json()['overview']
+        replica_habit = client.post('/api/habits', json=dict(habit_data, name='Replica Check'), headers=headers).get_json()['habit_id']
+        client.post(f'/api/habits/{replica_habit}/complete', json={'status': 'completed'}, headers=headers)
+        assert client.get('/api/analytics/dashboard', headers=headers).get_json()['overview'] == dashboard
+        replica.refresh()
+        refreshed = client.get('/api/analytics/dashboard', headers=headers).get_json()['overview']
+        assert refreshed['today_completed'] == dashboard['today_completed'] + 1, (dashboard, refreshed)
+        replica.max_staleness = 0
+        assert client.get('/api/analytics/dashboard', headers=headers).get_json()['overview'] == refreshed
+        
+        # Refreshes racing each other, as one per worker does, each build in a file of their own
+        racers = [threading.Thread(target=replica.refresh) for _ in range(4)]
+        for racer in racers:
+            racer.start()
+        for racer in racers:
+            racer.join()
+        assert not [name for name in os.listdir(os.path.dirname(replica.path)) if name.endswith('.tmp')]
+        assert client.get('/api/analytics/dashboard', headers=headers).get_json()['overview'] == refreshed
+        print('READ REPLICA ->', client.get('/api/metrics/storage').get_json())
+    finally:
+        app.extensions['read_replica'] = None
+
+    # 14. Unchanged data revalidates with a 304 and one key lookup; any write changes the ETag
+    for url in ('/api/habits', '/api/analytics/dashboard', '/api/analytics/calendar', '/api/user/profile'):
+        r = client.get(url, headers=headers)
+        etag = r.headers['ETag']
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            r = client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        assert r.status_code == 304 and not r.data and len(statements) == 1 and 'habit' not in statements[0], (url, r.status_code, statements)
+    client.post(f'/api/habits/{replica_habit}/complete', json={'status': 'skipped'}, headers=headers)
+    r = client.get('/api/analytics/dashboard', headers=dict(headers, **{'If-None-Match': etag}))
+    assert r.status_code == 200 and r.headers['ETag'] != etag
+    print('ETAG ->', etag, '->', r.headers['ETag'])
+    
+    # A write from outside this process (another worker, the CLI) changes it too, and the body with it
+    etag = r.headers['ETag']
+    progress = client.get('/api/user/profile', headers=headers).get_json()['user']
+    with sqlite3.connect(db.engine.url.database) as outside:
+        outside.execute('UPDATE "user" SET xp = xp + 500, level = level + 3, data_version = data_version + 1 WHERE id = ?', (user_id,))
+    outside.close()
+    r = client.get('/api/analytics/dashboard', headers=dict(headers, **{'If-None-Match': etag}))
+    assert r.status_code == 200 and r.headers['ETag'] != etag, r.status_code
+    assert r.get_json()['user']['xp'] == progress['xp'] + 500 and r.get_json()['user']['level'] == progress['level'] + 3, r.get_json()['user']
+    profile = client.get('/api/user/profile', headers=headers).get_json()['user']
+    assert (profile['xp'], profile['level']) == (progress['xp'] + 500, progress['level'] + 3), profile
+    with sqlite3.connect(db.engine.url.database) as outside:
+        outside.execute('UPDATE "user" SET xp = xp - 500, level = level - 3, data_version = data_version + 1 WHERE id = ?', (user_id,))
+    outside.close()
+
+    # 15. Repeat analytics reads come from the response cache until the user's data changes
+    first = client.get('/api/analytics/dashboard', headers=headers).get_json()
+    hits = client.get('/api/metrics/cache').get_json()['response_cache']['hits']
+    assert client.get('/api/analytics/dashboard', headers=headers).get_json() == first
+    assert client.get('/api/metrics/cache').get_json()['response_cache']['hits'] == hits + 1
+    client.post(f'/api/habits/{replica_habit}/complete', json={'status': 'completed'}, headers=headers)
+    after = client.get('/api/analytics/dashboard', headers=headers).get_json()
+    assert after['overview']['today_completed'] == first['overview']['today_completed'] + 1, (first, after)
+    shared = SQLiteCache(os.path.join(tempfile.mkdtemp(), 'cache.db'))
+    shared.set('a', b'1', tag=1)
+    shared.set('b', b'2', tag=2)
+    shared.invalidate_tag(1)
+    assert shared.get('a') is None and shared.get('b') == b'2'
+    
+    # The shared backend never serves a response from before another process's write
+    app_advanced.response_cache, local_cache = shared, app_advanced.response_cache
+    try:
+        cached = client.get('/api/analytics/dashboard', headers=headers).get_json()
+        with sqlite3.connect(db.engine.url.database) as outside:
+            outside.execute('UPDATE daily_rollup SET completed = completed + 1 WHERE habit_id = ? AND day = ?', (replica_habit, str(today)))
+            outside.execute('UPDATE "user" SET data_version = data_version + 1 WHERE id = ?', (user_id,))
+        outside.close()
+        assert client.get('/api/analytics/dashboard', headers=headers).get_json()['overview']['today_completed'] == cached['overview']['today_completed'] + 1
+        
+        # Nor a profile cached with progress from before it
+        progress = client.get('/api/user/profile', headers=headers).get_json()['user']
+        with sqlite3.connect(db.engine.url.database) as outside:
+            outside.execute('UPDATE "user" SET xp = xp + 500, level = level + 3, data_version = data_version + 1 WHERE id = ?', (user_id,))
+        outside.close()
+        client.get('/api/user/profile', headers=headers)
+        profile = client.get('/api/user/profile', headers=headers).get_json()['user']  # From the shared cache
+        assert (profile['xp'], profile['level']) == (progress['xp'] + 500, progress['level'] + 3), profile
+    finally:
+        app_advanced.response_cache = local_cache
+        with sqlite3.connect(db.engine.url.database) as outside:
+            outside.execute('UPDATE "user" SET xp = ?, level = ?, data_version = data_version + 1 WHERE id = ?', (progress['xp'], progress['level'], user_id))
+        outside.close()
+        rebuild_daily_rollups([user_id])
+        db.session.commit()
+    print('RESPONSE CACHE ->', client.get('/api/metrics/cache').get_json()['response_cache'])
+
+    # 16. An open event stream receives the deltas of a completion once it commits
+    stream = client.get(f'/api/events?token={token}', buffered=False)
+    chunks = iter(stream.response)
+    assert next(chunks).startswith(b'retry:')
+    client.post(f'/api/habits/{replica_habit}/complete', json={'status': 'skipped'}, headers=headers)
+    events = [next(chunks).decode() for _ in range(2)]
+    assert events[0].startswith('id: ') and 'event: habit_logged' in events[0] and '"status": "skipped"' in events[0], events
+    assert 'event: progress' in events[1], events
+    stream.close()
+    assert client.get('/api/metrics/events').get_json()['streams'] == 0
+    print('EVENTS ->', [event.split('\n')[1] for event in events])
+
+    # 17. Day boundaries follow the user's timezone, not the server's
+    tz_user = f"tz_{uuid.uuid4().hex[:8]}"
+    r = client.post('/api/auth/register', json={
+        'username': tz_user,
+        'email': f'{tz_user}@example.com',
+        'password': pwd,
+        'timezone': 'Pacific/Kiritimati'
+    })
+    tz_headers = {'Authorization': r.get_json()['token']}
+    r = client.post('/api/habits', json=habit_data, headers=tz_headers)
+    tz_habit_id = r.get_json()['habit_id']
+    client.post(f'/api/habits/{tz_habit_id}/complete', json={'status': 'completed'}, headers=tz_headers)
+    local_today = datetime.now(ZoneInfo('Pacific/Kiritimati')).date()
+    assert HabitLog.query.filter_by(habit_id=tz_habit_id).one().day == local_today
+    tz_habits = client.get('/api/habits', headers=tz_headers).get_json()
+    assert tz_habits[0]['today_status'] == 'completed' and tz_habits[0]['current_streak'] == 1, tz_habits
+    print('TIMEZONE DAY ->', local_today)
+
+    # 18. Reminders fire at local noon; smart ones skip habits already done today or past their cutoff
+    open_habit_id = client.post('/api/habits', json=habit_data, headers=tz_headers).get_json()['habit_id']
+    db.session.add_all([
+        Reminder(habit_id=tz_habit_id, time=time(12), is_smart=True),
+        Reminder(habit_id=tz_habit_id, time=time(12)),
+        Reminder(habit_id=open_habit_id, time=time(12), is_smart=True),
+        Reminder(habit_id=open_habit_id, time=time(12), is_smart=True, cutoff_time=time(11)),
+        Reminder(habit_id=open_habit_id, time=time(12), days='[7]', is_active=False)
+    ])
+    db.session.commit()
+    tz_user_id = User.query.filter_by(username=tz_user).one().id
+    zone = ZoneInfo('Pacific/Kiritimati')
+    midnight = datetime.combine(local_today, time(), tzinfo=zone)
+    delivered = queue.Queue()
+    scheduler = ReminderScheduler(QueueSink(delivered), habits_done_on)
+    scheduler.load([reminder for reminder in load_scheduled_reminders() if reminder.user_id == tz_user_id], midnight)
+    assert len(scheduler) == 4 and scheduler.tick(midnight + timedelta(hours=11)) == 0
+    assert scheduler.tick(midnight + timedelta(hours=12)) == 2
+    fired = sorted((item['habit_id'], item['due_at']) for item in delivered.queue)
+    noon = (midnight + timedelta(hours=12)).astimezone(ZoneInfo('UTC')).isoformat()
+    assert fired == [(tz_habit_id, noon), (open_habit_id, noon)], fired
+    assert (scheduler.suppressed, scheduler.dropped) == (1, 1), scheduler.stats()
+    assert scheduler.next_due() == (midnight + timedelta(days=1, hours=12)).timestamp()
+    
+    # A reload at the wake-up where the next noon falls due doesn't push those reminders a day on
+    next_noon = midnight + timedelta(days=1, hours=12)
+    assert scheduler.tick(next_noon - timedelta(seconds=0.5)) == 0
+    scheduler.load([reminder for reminder in load_scheduled_reminders() if reminder.user_id == tz_user_id], scheduler.last_tick)
+    assert scheduler.tick(next_noon + timedelta(milliseconds=1)) == 3, scheduler.stats()
+    print('REMINDERS ->', scheduler.stats())
+
+    # 19. Challenge counters follow completions, backfills and un-completions; ranks match the leaderboard
+    owner = User.query.filter_by(username=uname).one()
+    group = Group(name='Test group', code=uuid.uuid4().hex[:10], created_by=owner.id)
+    db.session.add(group)
+    db.session.flush()
+    today = user_today(owner)
+    challenge = Challenge(group_id=group.id, name='Test challenge', start_date=today - timedelta(days=10),
+                          end_date=today + timedelta(days=10), habit_template=json.dumps({'name': 'Challenge habit'}))
+    db.session.add(challenge)
+    db.session.commit()
+    challenge_habit = client.post(f'/api/challenges/{challenge.id}/join', headers=headers).get_json()['habit_id']
+    assert client.post(f'/api/challenges/{challenge.id}/join', headers=headers).status_code == 409
+    other_habit = client.post(f'/api/challenges/{challenge.id}/join', headers=tz_headers).get_json()['habit_id']
+    client.post(f'/api/habits/{other_habit}/complete', json={'status': 'completed'}, headers=tz_headers)
+    client.post(f'/api/habits/{challenge_habit}/complete', json={'status': 'completed'}, headers=headers)
+    client.post('/api/habits/complete/batch', json={'entries': [
+        {'habit_id': challenge_habit, 'day': (today - timedelta(days=offset)).isoformat()} for offset in (1, 2)
+    ] + [{'habit_id': challenge_habit, 'day': (today - timedelta(days=30)).isoformat()}]}, headers=headers)
+    board = client.get(f'/api/challenges/{challenge.id}/leaderboard', headers=tz_headers).get_json()
+    assert board['participants'] == 2 and [row['days_completed'] for row in board['top']] == [3, 1], board
+    assert board['top'][0]['current_streak'] == 3 and board['me']['rank'] == 2, board
+    client.post(f'/api/habits/{challenge_habit}/complete', json={'status': 'skipped'}, headers=headers)
+    board = client.get(f'/api/challenges/{challenge.id}/leaderboard', headers=headers).get_json()
+    assert board['me'] == {'rank': 1, 'days_completed': 2, 'current_streak': 2}, board
+    counters = [(p.days_completed, p.current_streak, p.last_completed_day) for p in ChallengeParticipant.query.filter_by(challenge_id=challenge.id).order_by(ChallengeParticipant.id)]
+    rebuild_challenge_counters(habit_ids=[challenge_habit, other_habit])
+    assert counters == [(p.days_completed, p.current_streak, p.last_completed_day) for p in ChallengeParticipant.query.filter_by(challenge_id=challenge.id).order_by(ChallengeParticipant.id)]
+    db.session.commit()
+    print('LEADERBOARD ->', board['top'])
+
+    # 20. Insights come from the offline generator: strong Mondays, mood tracking completions, a habit that slipped
+    insight_user = f"insight_{uuid.uuid4().hex[:8]}"
+    r = client.post('/api/auth/register', json={'username': insight_user, 'email': f'{insight_user}@example.com', 'password': pwd})
+    insight_headers = {'Authorization': r.get_json()['token']}
+    insight_user = User.query.filter_by(username=insight_user).one()
+    slipping, monday_a, monday_b = [client.post('/api/habits', json={'name': name, 'frequency': 'daily'}, headers=insight_headers).get_json()['habit_id']
+                                    for name in ('Stretching', 'Gym', 'Meal prep')]
+    today = user_today(insight_user)
+    entries = []
+    for offset in range(1, 85):
+        day = today - timedelta(days=offset)
+        habits_done = ([slipping] if offset > 14 else []) + ([monday_a, monday_b] if day.weekday() == 0 else [])
+        entries += [{'habit_id': habit_id, 'day': day.isoformat(), 'mood': len(habits_done) + 1} for habit_id in habits_done]
+    assert client.post('/api/habits/complete/batch', json={'entries': entries}, headers=insight_headers).status_code == 200
+    assert client.get('/api/ai/insights', headers=insight_headers).get_json() == []
+    generate_insights(user_ids=[insight_user.id], today=today)
+    generate_insights(user_ids=[insight_user.id], today=today)  # Replaces, doesn't pile up
+    statements.clear()
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        insights = client.get('/api/ai/insights', headers=insight_headers).get_json()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    assert not [statement for statement in statements if not statement.lstrip().upper().startswith('SELECT')], statements
+    assert sorted(insight['title'] for insight in insights) == ['Busier days, better moods', 'Mondays are your strongest day', 'Stretching has slipped'], insights
+    assert AIInsight.query.filter_by(user_id=insight_user.id).count() == 3
+    print('INSIGHTS ->', [(insight['title'], insight['confidence_score']) for insight in insights])
+
+    # 21. The numpy analytics backend answers exactly like the rollup queries
+    if HAVE_NUMPY:
+        urls = ['/api/analytics/dashboard', '/api/analytics/calendar',
+                f"/api/analytics/calendar?start_date={(today - timedelta(days=40)).isoformat()}&end_date={(today - timedelta(days=10)).isoformat()}"]
+        answers = {}
+        for backend in ('sql', 'numpy'):
+            app.config['ANALYTICS_BACKEND'] = backend
+            if response_cache is not None:
+                response_cache.clear()
+            answers[backend] = [client.get(url, headers=user_headers).get_json() for user_headers in (headers, insight_headers) for url in urls]
+        app.config['ANALYTICS_BACKEND'] = 'sql'
+        assert answers['sql'] == answers['numpy'], 'numpy backend differs'
+        print('ANALYTICS BACKENDS -> sql and numpy agree on', len(answers['sql']), 'responses')
+    else:
+        print('ANALYTICS BACKENDS -> numpy not installed, skipped')
+
+    # 22. Year bitmaps follow completions and skips, and give the same streaks as the streak records
+    app.config['BITSET_HISTORY'] = True
+    rebuild_year_bits([slipping, monday_a])
+    db.session.commit()
+    client.post(f'/api/habits/{slipping}/complete', json={'status': 'completed'}, headers=insight_headers)
+    client.post('/api/habits/complete/batch', json={'entries': [
+        {'habit_id': slipping, 'day': (today - timedelta(days=3)).isoformat(), 'status': 'skipped'},
+        {'habit_id': monday_a, 'day': (today - timedelta(days=1)).isoformat()}
+    ]}, headers=insight_headers)
+    for habit_id in (slipping, monday_a):
+        assert stored_year_bits(habit_id) == habit_year_bits([habit_id])[habit_id]
+        assert stored_year_bits(habit_id, today.year) == habit_year_bits([habit_id], today.year)[habit_id] == {today.year: stored_year_bits(habit_id)[today.year]}
+    heatmap = client.get(f'/api/habits/{slipping}/heatmap', headers=insight_headers).get_json()
+    completed = int.from_bytes(base64.b64decode(heatmap['completed']), 'little')
+    skipped = int.from_bytes(base64.b64decode(heatmap['skipped']), 'little')
+    assert completed >> (today.timetuple().tm_yday - 1) & 1 and skipped >> ((today - timedelta(days=3)).timetuple().tm_yday - 1) & 1
+    assert heatmap['completed_days'] == sum(heatmap['monthly_completed']) == HabitLog.query.filter(
+        HabitLog.habit_id == slipping, HabitLog.status == 'completed', HabitLog.day >= today.replace(month=1, day=1)
+    ).count()
+    assert (heatmap['current_streak'], heatmap['longest_streak']) == get_habit_streak(slipping, today) == (1, 70), heatmap
+    app.config['BITSET_HISTORY'] = False
+    assert client.get(f'/api/habits/{slipping}/heatmap', headers=insight_headers).get_json() == heatmap
+    print('HEATMAP ->', heatmap['year'], heatmap['monthly_completed'], heatmap['current_streak'], heatmap['longest_streak'])
+
+    # 23. The streak engine honours allow_skips and max_misses_per_week, and counts a day once
+    rules_user = f"rules_{uuid.uuid4().hex[:8]}"
+    r = client.post('/api/auth/register', json={'username': rules_user, 'email': f'{rules_user}@example.com', 'password': pwd})
+    rules_headers = {'Authorization': r.get_json()['token']}
+    today = user_today(User.query.filter_by(username=rules_user).one())
+    skips, misses, weekly, plain = [client.post('/api/habits', json=dict({'name': name, 'frequency': 'daily'}, **rules), headers=rules_headers).get_json()['habit_id']
+                                    for name, rules in (('Skips', {'allow_skips': True}), ('Misses', {'max_misses_per_week': 1}),
+                                                        ('Weekly', {'max_misses_per_week': 1}), ('Plain', {}))]
+    monday = today - timedelta(days=today.weekday() + 7)
+    entries = [{'habit_id': skips, 'day': (today - timedelta(days=offset)).isoformat(), 'status': status}
+               for offset, status in ((5, 'completed'), (4, 'skipped'), (3, 'completed'), (2, 'completed'), (1, 'skipped'))]
+    entries += [{'habit_id': misses, 'day': (today - timedelta(days=offset)).isoformat()} for offset in (9, 8, 6, 5, 2, 1)]
+    entries += [{'habit_id': weekly, 'day': (monday + timedelta(days=offset)).isoformat()} for offset in (0, 2, 4)]
+    entries += [{'habit_id': plain, 'day': (today - timedelta(days=offset)).isoformat()} for offset in (2, 1)]
+    assert client.post('/api/habits/complete/batch', json={'entries': entries}, headers=rules_headers).status_code == 200
+    db.session.add(HabitLog(habit_id=plain, day=today - timedelta(days=1), status='completed'))  # A second log on one day
+    rule_ids = [skips, misses, weekly, plain]
+    expected = {skips: (3, 3), misses: (2, 4), weekly: (0, 2), plain: (2, 2)}
+    assert get_habit_streaks(rule_ids, today) == expected, get_habit_streaks(rule_ids, today)
+    rebuild_habit_streaks(rule_ids)
+    assert get_habit_streaks(rule_ids, today) == expected
+    assert query_habit_streaks([skips])[skips] == (3, 3, today - timedelta(days=2), today - timedelta(days=1))
+    
+    # A skip today keeps the run going without adding to it
+    r = client.post(f'/api/habits/{skips}/complete', json={'status': 'skipped'}, headers=rules_headers).get_json()
+    assert (r['current_streak'], r['longest_streak']) == (3, 3), r
+    r = client.post(f'/api/habits/{skips}/complete', json={'status': 'completed'}, headers=rules_headers).get_json()
+    assert (r['current_streak'], r['longest_streak']) == (4, 4), r
+    listed = {habit['id']: (habit['current_streak'], habit['longest_streak']) for habit in client.get('/api/habits', headers=rules_headers).get_json()}
+    dashboard = client.get('/api/analytics/dashboard', headers=rules_headers).get_json()['habit_stats']
+    assert listed == {habit['id']: (habit['current_streak'], habit['longest_streak']) for habit in dashboard} == {**expected, skips: (4, 4)}, listed
+    heatmaps = {habit_id: client.get(f'/api/habits/{habit_id}/heatmap', headers=rules_headers).get_json() for habit_id in rule_ids}
+    assert {habit_id: (heatmap['current_streak'], heatmap['longest_streak']) for habit_id, heatmap in heatmaps.items()} == listed, heatmaps
+    print('STREAK RULES ->', listed)
+
+    # 24. Logs whose day was backfilled as the UTC date move to the user's local day, and their rollups with them
+    upgraded = HabitLog(habit_id=tz_habit_id, status='completed', completed_at=datetime(2025, 1, 10, 20), day=datetime(2025, 1, 10).date())
+    chosen = HabitLog(habit_id=tz_habit_id, status='completed', completed_at=datetime(2025, 3, 1, 20), day=datetime(2025, 2, 20).date())
+    db.session.add_all([upgraded, chosen])
+    db.session.commit()
+    assert rebucket_log_days(before=datetime(2025, 2, 1)) == 1
+    db.session.commit()
+    assert (str(upgraded.day), str(chosen.day)) == ('2025-01-11', '2025-02-20'), (upgraded.day, chosen.day)
+    assert [str(day) for (day,) in db.session.query(DailyRollup.day).filter(DailyRollup.habit_id == tz_habit_id, DailyRollup.day < datetime(2025, 2, 1).date())] == ['2025-01-11']
+    print('REBUCKETED ->', upgraded.completed_at, '->', upgraded.day)
+
     print('Internal advanced tests completed')
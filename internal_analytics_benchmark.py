@@ -0,0 +1,78 @@
+import os, tempfile, time
+
+# Analytics backends against 1, 5 and 10 years of history, on a scratch database
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_analytics.db'))
+
+from app_advanced import app, db, init_db, User, Habit, HabitLog, rebuild_habit_streaks, rebuild_daily_rollups, user_today, response_cache, matrix_cache
+from completion_matrix import HAVE_NUMPY
+from sqlalchemy import insert
+from datetime import datetime, time as day_time, timedelta
+import uuid
+
+HABITS = 50
+YEARS = (1, 5, 10)
+RUNS = 10
+
+def register(client):
+    uname = f"bench_{uuid.uuid4().hex[:8]}"
+    r = client.post('/api/auth/register', json={'username': uname, 'email': f'{uname}@example.com', 'password': 'password123'})
+    return User.query.filter_by(username=uname).one(), {'Authorization': r.get_json()['token']}
+
+def seed_history(user, days):
+    # Most days completed, some skipped, a few with a mood, going back `days` days
+    db.session.execute(insert(Habit), [{'user_id': user.id, 'name': f'Bench Habit {i}', 'frequency': 'daily'} for i in range(HABITS)])
+    habit_ids = [habit_id for (habit_id,) in db.session.query(Habit.id).filter_by(user_id=user.id)]
+    today = user_today(user)
+    rows = []
+    for habit_id in habit_ids:
+        for offset in range(days):
+            if (habit_id + offset) % 11 == 0:
+                continue
+            day = today - timedelta(days=offset)
+            rows.append({'habit_id': habit_id, 'status': 'skipped' if (habit_id + offset) % 7 == 0 else 'completed', 'value': 1.0,
+                         'mood': (habit_id + offset) % 5 + 1 if offset % 3 == 0 else None, 'day': day, 'completed_at': datetime.combine(day, day_time(8))})
+    db.session.execute(insert(HabitLog), rows)
+    rebuild_habit_streaks(habit_ids)
+    rebuild_daily_rollups([user.id])
+    db.session.commit()
+    return len(rows)
+
+def time_backend(client, url, headers, backend, cold=True):
+    # Never from the response cache; cold also reloads the numpy backend's matrix every time
+    app.config['ANALYTICS_BACKEND'] = backend
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        if response_cache is not None:
+            response_cache.clear()
+        if cold:
+            matrix_cache.clear()
+        r = client.get(url, headers=headers)
+        assert r.status_code == 200
+    return (time.perf_counter() - start) / RUNS * 1000, r.get_json()
+
+with app.app_context():
+    client = app.test_client()
+    print("Running analytics backend benchmarks on", app.config['SQLALCHEMY_DATABASE_URI'])
+    if not HAVE_NUMPY:
+        raise SystemExit('numpy is not installed; pip install numpy to compare the backends')
+    init_db()
+
+    for years in YEARS:
+        user, headers = register(client)
+        log_count = seed_history(user, years * 365)
+        today = user_today(user)
+        print(f'{years:>2} years, {HABITS} habits, {log_count} logs')
+        urls = [
+            ('dashboard', '/api/analytics/dashboard'),
+            ('calendar, last year', f'/api/analytics/calendar?start_date={(today - timedelta(days=365)).isoformat()}'),
+            ('calendar, all history', '/api/analytics/calendar')
+        ]
+        for label, url in urls:
+            sql_ms, sql_answer = time_backend(client, url, headers, 'sql')
+            cold_ms, numpy_answer = time_backend(client, url, headers, 'numpy')
+            warm_ms, _ = time_backend(client, url, headers, 'numpy', cold=False)
+            assert sql_answer == numpy_answer
+            print(f'   {label:<22} sql {sql_ms:8.2f} ms   numpy {cold_ms:8.2f} ms loading the matrix, {warm_ms:8.2f} ms loaded ({sql_ms / warm_ms:.1f}x)')
+
+    app.config['ANALYTICS_BACKEND'] = 'sql'
+    print('Benchmarks completed')
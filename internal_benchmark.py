@@ -0,0 +1,58 @@
+import os, tempfile, time
+
+# Benchmark against a scratch database so habits.db is left alone
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from app import app, db, init_db, Habit, HabitLog
+from sqlalchemy import event, insert
+from datetime import datetime, timedelta
+
+HABITS = 40
+RUNS = 50
+
+def seed_logs(habit_ids, start, stop):
+    # Spread logs evenly across habits, one per habit per day going back in time
+    now = datetime.utcnow()
+    rows = []
+    for i in range(start, stop):
+        completed_at = now - timedelta(days=i // len(habit_ids))
+        rows.append({'habit_id': habit_ids[i % len(habit_ids)], 'completed_at': completed_at, 'day': completed_at.date(), 'count': 1})
+    db.session.execute(insert(HabitLog), rows)
+    db.session.commit()
+
+def time_endpoint(client, url):
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            r = client.get(url)
+            assert r.status_code == 200
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    return elapsed / RUNS * 1000, len(statements) // RUNS
+
+with app.app_context():
+    client = app.test_client()
+    print("Running app.py benchmarks on", app.config['SQLALCHEMY_DATABASE_URI'])
+    init_db()
+
+    habits = [Habit(name=f'Bench Habit {i}', category='Bench', frequency='daily') for i in range(HABITS)]
+    db.session.add_all(habits)
+    db.session.commit()
+    habit_ids = [habit.id for habit in habits]
+
+    # GET /api/stats should cost the same whatever the log history size
+    seeded = 0
+    for total in (1000, 10000, 100000):
+        seed_logs(habit_ids, seeded, total)
+        seeded = total
+        ms, queries = time_endpoint(client, '/api/stats')
+        print(f'GET /api/stats  {total:>7} logs  {ms:7.2f} ms/request  {queries} queries')
+
+    print('Benchmarks completed')
@@ -0,0 +1,87 @@
+import os, subprocess, sys, tempfile, threading, time
+
+# Concurrent write load against app_advanced.py under each storage profile.
+# Profiles are applied when the app is imported, so each one runs in a fresh process.
+WRITERS = 16
+READERS = 8
+DURATION = 5  # seconds
+
+def run_profile():
+    from app_advanced import app, init_db
+    from flask import got_request_exception
+    import uuid
+
+    counts = {'writes': 0, 'reads': 0, 'lock_errors': 0, 'other_errors': 0}
+    latencies = {'writes': [], 'reads': []}
+    lock = threading.Lock()
+
+    def record_exception(sender, exception, **extra):
+        with lock:
+            counts['lock_errors' if 'database is locked' in str(exception) else 'other_errors'] += 1
+
+    got_request_exception.connect(record_exception, app)
+
+    with app.app_context():
+        init_db()
+
+    client = app.test_client()
+    sessions = []
+    for _ in range(WRITERS):
+        uname = f"load_{uuid.uuid4().hex[:8]}"
+        r = client.post('/api/auth/register', json={'username': uname, 'email': f'{uname}@example.com', 'password': 'password123'})
+        headers = {'Authorization': r.get_json()['token']}
+        habit_ids = [client.post('/api/habits', json={'name': f'Load {i}', 'frequency': 'daily'}, headers=headers).get_json()['habit_id'] for i in range(5)]
+        sessions.append((headers, habit_ids))
+
+    deadline = time.perf_counter() + DURATION
+
+    def writer(headers, habit_ids):
+        client = app.test_client()
+        n = 0
+        while time.perf_counter() < deadline:
+            status = 'completed' if n % 2 == 0 else 'skipped'
+            started = time.perf_counter()
+            r = client.post(f'/api/habits/{habit_ids[n % len(habit_ids)]}/complete', json={'status': status}, headers=headers)
+            if r.status_code == 200:
+                with lock:
+                    counts['writes'] += 1
+                    latencies['writes'].append(time.perf_counter() - started)
+            n += 1
+
+    def reader(headers):
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if client.get('/api/analytics/dashboard', headers=headers).status_code == 200:
+                with lock:
+                    counts['reads'] += 1
+                    latencies['reads'].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer, args=session) for session in sessions]
+    threads += [threading.Thread(target=reader, args=(sessions[i % WRITERS][0],)) for i in range(READERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    def p95(samples):
+        return sorted(samples)[int(len(samples) * 0.95)] * 1000 if samples else float('nan')
+
+    attempts = counts['writes'] + counts['lock_errors'] + counts['other_errors']
+    label = '+'.join(filter(None, [app.config['STORAGE_PROFILE'], app.config['READ_REPLICA']]))
+    print(f"{label:<18} {counts['writes'] / DURATION:7.1f} writes/s (p95 {p95(latencies['writes']):6.0f} ms)  "
+          f"{counts['reads'] / DURATION:7.1f} reads/s (p95 {p95(latencies['reads']):6.0f} ms)  "
+          f"{counts['lock_errors']} locked ({counts['lock_errors'] / max(attempts, 1):.1%})  {counts['other_errors']} other errors")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run_profile()
+    else:
+        from storage import STORAGE_PROFILES
+        print(f'Storage load test: {WRITERS} writers, {READERS} readers, {DURATION}s per profile')
+        # Every profile on its own, then the dashboard reads moved to a read replica
+        runs = [(profile, '') for profile in STORAGE_PROFILES] + [('default', 'snapshot'), ('wal', 'snapshot'), ('wal', 'readonly')]
+        for profile, replica in runs:
+            env = dict(os.environ, STORAGE_PROFILE=profile, READ_REPLICA=replica, DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db'))
+            subprocess.run([sys.executable, os.path.abspath(__file__), profile], env=env, check=True)
+        print('Load test completed')
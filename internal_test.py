@@ -1,12 +1,12 @@
-from app import app, db
+from app import app, db, init_db
 import json
 
 with app.app_context():
     client = app.test_client()
     print("Running internal API tests using Flask test_client")
 
-    # Ensure DB tables exist
-    db.create_all()
+    # Ensure DB tables exist and are migrated
+    init_db()
 
     # 1. GET /api/habits (initial)
     r = client.get('/api/habits')
@@ -0,0 +1,169 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import heapq
+import itertools
+import json
+import threading
+import time
+
+# Everything the scheduler needs about one reminder; weekdays are ISO (1 = Monday), None for every day
+ScheduledReminder = namedtuple('ScheduledReminder', [
+    'id', 'habit_id', 'user_id', 'habit_name', 'time', 'weekdays', 'zone', 'is_smart', 'cutoff_time'
+])
+
+def parse_weekdays(days):
+    """Reminder.days ("[1,2,3,4,5]") -> frozenset of ISO weekdays, or None for every day."""
+    if not days:
+        return None
+    weekdays = frozenset(7 if day == 0 else int(day) for day in json.loads(days))
+    return weekdays or None
+
+def next_fire(reminder, after):
+    """First moment strictly after `after` (aware) when the reminder is due, in UTC."""
+    local = after.astimezone(reminder.zone)
+    for offset in range(8):
+        day = local.date() + timedelta(days=offset)
+        if reminder.weekdays is not None and day.isoweekday() not in reminder.weekdays:
+            continue
+        fire_at = datetime.combine(day, reminder.time, tzinfo=reminder.zone)
+        if fire_at > after:
+            return fire_at.astimezone(timezone.utc)
+    return None  # No weekday matches
+
+class FileSink:
+    """Append each delivered batch to a file as NDJSON; a stand-in for a push or mail queue."""
+    
+    def __init__(self, path):
+        self.path = path
+        self.delivered = 0
+    
+    def send(self, notifications):
+        with open(self.path, 'a', encoding='utf-8') as out:
+            out.writelines(json.dumps(notification) + '\n' for notification in notifications)
+        self.delivered += len(notifications)
+
+class QueueSink:
+    """Hand each notification to a queue.Queue (or anything with put()) for an in-process worker."""
+    
+    def __init__(self, target):
+        self.target = target
+        self.delivered = 0
+    
+    def send(self, notifications):
+        for notification in notifications:
+            self.target.put(notification)
+        self.delivered += len(notifications)
+
+class ReminderScheduler:
+    """Fire reminders in order of their next fire time, kept in a heap.
+    
+    tick() pops everything that is due, asks done_today() once for all the
+    smart reminders among them, hands the rest to the sink in one batch and
+    pushes each reminder back at its following fire time. done_today receives a
+    set of (habit_id, local day) pairs and returns the ones already done.
+    """
+    
+    def __init__(self, sink, done_today, max_lateness=timedelta(hours=1)):
+        self.sink = sink
+        self.done_today = done_today
+        self.max_lateness = max_lateness
+        self._heap = []  # (fire timestamp, sequence, reminder)
+        self._sequence = itertools.count()
+        
+        self.fired = 0
+        self.suppressed = 0  # smart reminders for habits already done
+        self.dropped = 0  # too late, or past the cutoff
+        self.ticks = 0
+        self.last_tick = None
+    
+    def load(self, reminders, now):
+        """Replace the schedule with these reminders, each at its next fire time after now.
+        
+        Reloading a running schedule passes the last tick's time, so whatever fell due
+        since then is still delivered by the next tick rather than pushed to its next day.
+        """
+        heap = []
+        for reminder in reminders:
+            fire_at = next_fire(reminder, now)
+            if fire_at is not None:
+                heap.append((fire_at.timestamp(), next(self._sequence), reminder))
+        heapq.heapify(heap)
+        self._heap = heap
+    
+    def __len__(self):
+        return len(self._heap)
+    
+    def next_due(self):
+        """Timestamp of the earliest scheduled fire, or None."""
+        return self._heap[0][0] if self._heap else None
+    
+    def tick(self, now):
+        """Deliver every reminder due at or before now. Returns the number sent."""
+        self.ticks += 1
+        self.last_tick = now
+        due = []
+        now_ts = now.timestamp()
+        while self._heap and self._heap[0][0] <= now_ts:
+            fire_ts, _, reminder = heapq.heappop(self._heap)
+            due.append((datetime.fromtimestamp(fire_ts, timezone.utc), reminder))
+        if not due:
+            return 0
+        
+        # One lookup for every smart reminder in this tick
+        smart_keys = {
+            (reminder.habit_id, fire_at.astimezone(reminder.zone).date())
+            for fire_at, reminder in due if reminder.is_smart
+        }
+        done = self.done_today(smart_keys) if smart_keys else set()
+        
+        notifications = []
+        for fire_at, reminder in due:
+            local_now = now.astimezone(reminder.zone)
+            if now - fire_at > self.max_lateness or (reminder.cutoff_time and local_now.time() > reminder.cutoff_time):
+                self.dropped += 1
+            elif reminder.is_smart and (reminder.habit_id, fire_at.astimezone(reminder.zone).date()) in done:
+                self.suppressed += 1
+            else:
+                notifications.append({
+                    'reminder_id': reminder.id,
+                    'habit_id': reminder.habit_id,
+                    'user_id': reminder.user_id,
+                    'habit_name': reminder.habit_name,
+                    'due_at': fire_at.isoformat()
+                })
+            
+            following = next_fire(reminder, max(fire_at, now))
+            if following is not None:
+                heapq.heappush(self._heap, (following.timestamp(), next(self._sequence), reminder))
+        
+        if notifications:
+            self.sink.send(notifications)
+        self.fired += len(notifications)
+        return len(notifications)
+    
+    def run(self, stop=None, reload=None, reload_every=60, max_sleep=1.0):
+        """Tick until stop (a threading.Event) is set, sleeping until the next reminder is due.
+        
+        reload(), if given, returns fresh reminders every reload_every seconds.
+        """
+        stop = stop or threading.Event()
+        reloaded = time.monotonic()
+        while not stop.is_set():
+            now = datetime.now(timezone.utc)
+            if reload is not None and time.monotonic() - reloaded >= reload_every:
+                self.load(reload(), self.last_tick or now)
+                reloaded = time.monotonic()
+            self.tick(now)
+            
+            next_due = self.next_due()
+            wait = max_sleep if next_due is None else min(max_sleep, max(0.0, next_due - time.time()))
+            stop.wait(wait)
+    
+    def stats(self):
+        return {
+            'scheduled': len(self._heap),
+            'fired': self.fired,
+            'suppressed': self.suppressed,
+            'dropped': self.dropped,
+            'ticks': self.ticks
+        }
@@ -6,6 +6,9 @@ let categories = [];
 let currentSection = 'dashboard';
 let currentHabitId = null;
 let analyticsChart = null;
+let eventSource = null;
+let pendingRefresh = null;  // Fallback refetch while waiting for our own change's delta
+const DELTA_WAIT_MS = 2000;
 
 // Initialize the app
 document.addEventListener('DOMContentLoaded', function() {
@@ -21,6 +24,7 @@ function checkAuth() {
     } else {
         loadUserProfile();
         loadDashboard();
+        connectEvents();
     }
 }
 
@@ -119,6 +123,7 @@ async function login() {
             bootstrap.Modal.getInstance(document.getElementById('loginModal')).hide();
             loadUserProfile();
             loadDashboard();
+            connectEvents();
             showSuccess('Login successful!');
         } else {
             showError(data.error || 'Login failed');
@@ -151,6 +156,7 @@ async function register() {
             bootstrap.Modal.getInstance(document.getElementById('loginModal')).hide();
             loadUserProfile();
             loadDashboard();
+            connectEvents();
             showSuccess('Registration successful!');
         } else {
             showError(data.error || 'Registration failed');
@@ -219,6 +225,84 @@ async function loadDashboard() {
     }
 }
 
+// Live updates: the server pushes deltas after every change (GET /api/events)
+function connectEvents() {
+    if (eventSource || !window.EventSource) return;
+    
+    let connectedBefore = false;
+    eventSource = new EventSource(`/api/events?token=${encodeURIComponent(authToken)}`);
+    
+    eventSource.addEventListener('open', () => {
+        // Changes made while we were reconnecting were not pushed to us
+        if (connectedBefore) refreshAll();
+        connectedBefore = true;
+    });
+    eventSource.addEventListener('habit_logged', event => applyHabitLogged(JSON.parse(event.data)));
+    eventSource.addEventListener('progress', event => applyProgress(JSON.parse(event.data)));
+    eventSource.addEventListener('badge_earned', event => {
+        const badge = JSON.parse(event.data);
+        showSuccess(`Badge earned: ${badge.name}!`);
+        loadUserProfile();
+    });
+    eventSource.addEventListener('resync', refreshAll);
+}
+
+// After a change of our own: the event stream usually brings the deltas, but it may be held
+// by another worker process than the one that took the change, so refetch if none arrives
+function refreshAfterChange() {
+    clearTimeout(pendingRefresh);
+    if (eventSource && eventSource.readyState === EventSource.OPEN) {
+        pendingRefresh = setTimeout(refreshAll, DELTA_WAIT_MS);
+        return;
+    }
+    refreshAll();
+}
+
+function refreshAll() {
+    loadUserProfile();
+    loadDashboard();
+    if (currentSection === 'habits') loadHabits();
+}
+
+function applyHabitLogged(data) {
+    clearTimeout(pendingRefresh);
+    const habit = habits.find(h => h.id === data.habit_id);
+    if (!habit) {
+        refreshAll();
+        return;
+    }
+    
+    if (data.is_today) {
+        habit.today_status = data.status;
+        if (habit.today_progress) {
+            habit.today_progress.current = data.value || 0;
+            habit.today_progress.percentage = habit.today_progress.target > 0
+                ? Math.min(100, (habit.today_progress.current / habit.today_progress.target) * 100) : 0;
+        }
+    }
+    habit.current_streak = data.current_streak;
+    habit.longest_streak = data.longest_streak;
+    
+    renderTodayHabits(habits);
+    if (currentSection === 'habits') renderHabitsList(habits);
+    
+    const completed = habits.filter(h => h.today_status === 'completed').length;
+    document.getElementById('todayCompleted').textContent = completed;
+    document.getElementById('completionRate').textContent = (habits.length ? Math.round(completed / habits.length * 100) : 0) + '%';
+    document.getElementById('currentStreak').textContent = Math.max(0, ...habits.map(h => h.current_streak));
+}
+
+function applyProgress(data) {
+    if (currentUser) {
+        currentUser.level = data.level;
+        currentUser.xp = data.xp;
+        currentUser.total_coins = data.total_coins;
+    }
+    document.getElementById('userLevel').textContent = data.level;
+    document.getElementById('userCoins').textContent = data.total_coins;
+    document.getElementById('xpProgress').style.width = data.xp_progress + '%';
+}
+
 // Load today's habits
 async function loadTodayHabits() {
     try {
@@ -483,9 +567,7 @@ async function confirmComplete() {
         if (response.ok) {
             bootstrap.Modal.getInstance(document.getElementById('completeModal')).hide();
             showSuccess('Habit logged successfully!');
-            loadHabits();
-            loadDashboard();
-            loadUserProfile(); // Update XP and level
+            refreshAfterChange();
         } else {
             const data = await response.json();
             showError(data.error || 'Failed to log habit');
@@ -509,8 +591,7 @@ async function skipHabit(habitId) {
         
         if (response.ok) {
             showSuccess('Habit skipped');
-            loadHabits();
-            loadDashboard();
+            refreshAfterChange();
         }
     } catch (error) {
         showError('Failed to skip habit');
@@ -531,8 +612,7 @@ async function missHabit(habitId) {
         
         if (response.ok) {
             showSuccess('Habit marked as missed');
-            loadHabits();
-            loadDashboard();
+            refreshAfterChange();
         }
     } catch (error) {
         showError('Failed to mark habit as missed');
@@ -680,6 +760,7 @@ function toggleSidebar() {
 
 // Logout
 function logout() {
+    if (eventSource) eventSource.close();
     localStorage.removeItem('authToken');
     authToken = null;
     currentUser = null;
@@ -0,0 +1,227 @@
+from contextlib import closing
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# Connection settings, chosen with the STORAGE_PROFILE environment variable.
+# Pragmas only apply to SQLite; pool sizing applies to any database URL.
+STORAGE_PROFILES = {
+    # SQLite's own behaviour: rollback journal, fsync on every commit
+    'default': {
+        'pragmas': {},
+        'pool_size': 5,
+        'max_overflow': 10
+    },
+    # Readers and the writer don't block each other; fsync at checkpoints only,
+    # so a power cut can lose the last commits but never corrupts the file
+    'wal': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 10000,  # ms to wait for the write lock before "database is locked"
+            'cache_size': -16000,  # KiB
+            'mmap_size': 134217728,
+            'temp_store': 'MEMORY'
+        },
+        'pool_size': 10,
+        'max_overflow': 20
+    },
+    # WAL, but every commit is fsynced before it returns
+    'durable': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'busy_timeout': 10000,
+            'cache_size': -16000,
+            'mmap_size': 134217728,
+            'temp_store': 'MEMORY'
+        },
+        'pool_size': 10,
+        'max_overflow': 20
+    },
+    # Throwaway databases (tests, benchmarks): nothing is fsynced at all
+    'ephemeral': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'OFF',
+            'busy_timeout': 10000,
+            'cache_size': -16000,
+            'temp_store': 'MEMORY'
+        },
+        'pool_size': 10,
+        'max_overflow': 20
+    }
+}
+
+def configure_storage(app, default_url):
+    """Set the database URL and engine options from the environment.
+    
+    DATABASE_URL overrides default_url, STORAGE_PROFILE picks one of
+    STORAGE_PROFILES (default when unset) and DB_POOL_SIZE / DB_MAX_OVERFLOW
+    override its pool sizing. READ_REPLICA and READ_REPLICA_MAX_STALENESS
+    configure the optional ReadReplica. Call before SQLAlchemy(app), then
+    apply_pragmas().
+    """
+    profile_name = os.environ.get('STORAGE_PROFILE', 'default')
+    if profile_name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown STORAGE_PROFILE {profile_name!r}, expected one of {', '.join(STORAGE_PROFILES)}")
+    profile = STORAGE_PROFILES[profile_name]
+    url = os.environ.get('DATABASE_URL', default_url)
+    
+    engine_options = {}
+    # In-memory SQLite runs on a single shared connection, so there is no pool to size
+    parsed = make_url(url)
+    if not (parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:')):
+        engine_options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', profile['pool_size']))
+        engine_options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', profile['max_overflow']))
+    
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    app.config['STORAGE_PROFILE'] = profile_name
+    app.config['READ_REPLICA'] = os.environ.get('READ_REPLICA')  # snapshot, readonly or unset
+    app.config['READ_REPLICA_MAX_STALENESS'] = float(os.environ.get('READ_REPLICA_MAX_STALENESS', 5))  # seconds
+
+def apply_pragmas(app, db):
+    """Run the profile's PRAGMAs on every new SQLite connection."""
+    pragmas = STORAGE_PROFILES[app.config['STORAGE_PROFILE']]['pragmas']
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    
+    set_pragmas_on_connect(engine, pragmas)
+
+def set_pragmas_on_connect(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+class RoutingSession(Session):
+    """Session that sends everything to session.info['replica'] while it is set."""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if bind is None and replica is not None:
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+class ReadReplica:
+    """Read-only view of the primary SQLite database for read-heavy routes.
+    
+    'snapshot' keeps a copy next to the primary file, rebuilt with SQLite's
+    online backup API every max_staleness / 2 seconds (never more often than
+    MIN_REFRESH_INTERVAL) by a background thread; engine_for_read() returns
+    None (use the primary) whenever the copy is older than max_staleness.
+    'readonly' opens the primary itself read-only on its own connection pool,
+    which never lags but only stays out of the writers' way when the primary
+    is in WAL mode.
+    """
+    
+    READ_PRAGMAS = {'query_only': 'ON', 'busy_timeout': 10000, 'cache_size': -16000, 'mmap_size': 134217728}
+    MIN_REFRESH_INTERVAL = 1.0  # seconds between background refreshes, whatever max_staleness is
+    
+    def __init__(self, primary_engine, mode='snapshot', max_staleness=5.0):
+        if primary_engine.dialect.name != 'sqlite':
+            raise ValueError('READ_REPLICA needs a SQLite primary; point other databases at a replica server instead')
+        if mode not in ('snapshot', 'readonly'):
+            raise ValueError(f'Unknown READ_REPLICA mode {mode!r}, expected snapshot or readonly')
+        
+        self.mode = mode
+        self.max_staleness = max_staleness
+        self.primary_path = primary_engine.url.database
+        root, ext = os.path.splitext(self.primary_path)
+        self.path = f'{root}-replica{ext}' if mode == 'snapshot' else self.primary_path
+        self.engine = create_engine(f'sqlite:///file:{self.path}?mode=ro&uri=true')
+        set_pragmas_on_connect(self.engine, self.READ_PRAGMAS)
+        
+        self.refreshed_at = None  # monotonic time the last completed backup started
+        self.refreshes = 0
+        self.routed = 0
+        self.fallbacks = 0
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def engine_for_read(self):
+        """The replica engine if it is within the staleness bound, else None."""
+        if self.mode == 'readonly':
+            self.routed += 1
+            return self.engine
+        
+        if self._thread is None:
+            self.start()
+        if self.age() > self.max_staleness:
+            self.fallbacks += 1
+            return None
+        self.routed += 1
+        return self.engine
+    
+    def age(self):
+        if self.mode == 'readonly':
+            return 0.0
+        return float('inf') if self.refreshed_at is None else time.monotonic() - self.refreshed_at
+    
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.refresh()
+            self._thread = threading.Thread(target=self._refresh_forever, name='read-replica', daemon=True)
+            self._thread.start()
+    
+    def refresh(self):
+        started = time.monotonic()
+        # Every worker process refreshes on its own, so each builds in a file of its own
+        handle, building = tempfile.mkstemp(prefix=f'{os.path.basename(self.path)}.', suffix='.tmp', dir=os.path.dirname(self.path) or '.')
+        os.close(handle)
+        try:
+            with closing(sqlite3.connect(self.primary_path)) as source, closing(sqlite3.connect(building)) as target:
+                source.backup(target)
+                # Read-only connections can't open a WAL database without its -shm file
+                target.execute('PRAGMA journal_mode = DELETE')
+            
+            # Swap the new copy in whole so readers never wait on a refresh; connections
+            # still reading the old copy finish on it and are closed when returned
+            os.replace(building, self.path)
+        except BaseException:
+            os.remove(building)
+            raise
+        self.engine.dispose()
+        self.refreshed_at = started
+        self.refreshes += 1
+    
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'max_staleness': self.max_staleness,
+            'age': None if self.age() == float('inf') else round(self.age(), 3),
+            'refreshes': self.refreshes,
+            'routed': self.routed,
+            'fallbacks': self.fallbacks
+        }
+    
+    def _refresh_forever(self):
+        while True:
+            # A max_staleness of 0 would otherwise copy the database in a tight loop
+            time.sleep(max(self.max_staleness / 2, self.MIN_REFRESH_INTERVAL))
+            try:
+                self.refresh()
+            except (sqlite3.Error, OSError):
+                logging.getLogger(__name__).exception('Read replica refresh failed; reads stay on the primary')
+
+def create_read_replica(app, db):
+    """Build the ReadReplica READ_REPLICA asks for, or None when it is unset."""
+    if not app.config.get('READ_REPLICA'):
+        return None
+    with app.app_context():
+        engine = db.engine
+    return ReadReplica(engine, app.config['READ_REPLICA'], app.config['READ_REPLICA_MAX_STALENESS'])